@@ -3,12 +3,12 @@ from builtins import range
 
 import errno
 import os
+from stat import S_ISREG
 
 from cfv import osutil
 
 
 # TODO: do some benchmarking of how useful _path_key_cache is on different OS's
-# TODO: To handle hard-linked files efficiently, size and hash attributes should stored by <path key>, not by filename.  (Other attributes should still be stored by filename.)
 # TODO: Only set _verified, _ok attributes when we actually will need them.
 # TODO: stop common.py mucking with _path_key_cache member.  (Move chdir/cdup functions here, or even better don't chang directories at all.)
 # TODO: make nocase_* functions not depend on current dir
@@ -17,14 +17,30 @@ class FileInfoCache(object):
         # data is a mapping of <path key> -> <path cache>
         # <path key> is either a (dev, inode) pair or a full pathname (from os.path.realpath)
         # <path cache> is map from filename(without path, relative to path key) -> <finfo>
-        # <finfo> is a map of <attr> -> <value>
-        # <attr> can be '_verified', '_ok', 'size', <any hash name>
+        # <finfo> is a map of <flag> -> <value>
+        # <flag> can be '_verified', '_ok'
         self.data = {}
+        # map of <content key> -> <cinfo>
+        # <content key> is either a (dev, inode) pair, so that all hard links to a file share it, or a full pathname (from os.path.realpath)
+        # <cinfo> is a map of <attr> -> <value>
+        # <attr> can be 'size', <any hash name>
+        self.content = {}
+        # map of <content key> -> <want>
+        # <want> is a map of <hash name> -> <hasher> of the hashes that checksum files yet to be tested will need
+        self.wanted = {}
         # map from <path key> -> <nocase map>
         # <nocase map> is a map from <lowercase> -> [<orig name1>, <orig name2>, ...]
         self._nocase_dir_cache = {}
-        # the <finfo> map for stdin
+        # map from <path key> -> <size index>
+        # <size index> is a map from <size> -> [<name1>, <name2>, ...] of the regular files in the dir, in listdir order.  Size -1 maps to all of them.
+        # Indexes of whole trees are keyed by ('tree', <root>) instead, and hold the absolute paths of the files.
+        self._size_index_cache = {}
+        # map from (<path key>, <size>) -> <type name> -> <digest index>
+        # <digest index> is a map from <digest> -> [<name1>, <name2>, ...] of the files in the size index of that dir and size, and None -> [<names not digested yet>]
+        self._digest_index_cache = {}
+        # the <finfo> and <cinfo> maps for stdin
         self.stdin_finfo = {}
+        self.stdin_cinfo = {}
         # map of <path> (relative to curdir) -> <path key>
         # this member is saved/cleared/restored by chdir and cdup functions in common.py
         self._path_key_cache = {}
@@ -41,11 +57,12 @@ class FileInfoCache(object):
     def has_flag(self, fn, flag):
         return flag in self.getfinfo(fn)
 
-    def get_path_key(self, path):
+    def get_path_key(self, path, st=None):
         dk = self._path_key_cache.get(path)
         if dk is not None:
             return dk
-        st = os.stat(path or osutil.curdiru)
+        if st is None:
+            st = os.stat(path or osutil.curdiru)
         if st.st_ino:
             dk = (st.st_dev, st.st_ino)
         else:
@@ -53,8 +70,12 @@ class FileInfoCache(object):
         self._path_key_cache[path] = dk
         return dk
 
-    def getpathcache(self, path):
-        pathkey = self.get_path_key(path)
+    def getpathcache(self, path, st=None):
+        """Return the cache of the files in dir path.
+
+        st can be given if path has already been stat'ed.
+        """
+        pathkey = self.get_path_key(path, st)
         pathcache = self.data.get(pathkey)
         if pathcache is None:
             self.data[pathkey] = pathcache = {}
@@ -71,6 +92,36 @@ class FileInfoCache(object):
                 pathdata[ftail] = finfo = {}
             return finfo
 
+    def get_content_key(self, fn, st=None):
+        if st is None:
+            st = os.stat(fn)
+        if st.st_ino:
+            return st.st_dev, st.st_ino
+        return os.path.realpath(fn)
+
+    def getcinfo(self, fn, st=None):
+        """Return the content attributes of fn, which are shared by all hard links to the same file.
+
+        st can be given if fn has already been stat'ed.
+        """
+        if fn == '':
+            return self.stdin_cinfo
+        ck = self.get_content_key(fn, st)
+        cinfo = self.content.get(ck)
+        if cinfo is None:
+            self.content[ck] = cinfo = {}
+        return cinfo
+
+    def want(self, fn, hashers):
+        """Note that hashers (name -> hasher) will be needed for fn, so that they can be calculated whenever it is read."""
+        self.wanted.setdefault(self.get_content_key(fn), {}).update(hashers)
+
+    def getwanted(self, fn):
+        """Return the map of hash name -> hasher that will be needed for fn."""
+        if not self.wanted or fn == '':
+            return {}
+        return self.wanted.get(self.get_content_key(fn), {})
+
     def rename(self, oldfn, newfn):
         ofinfo = self.getfinfo(oldfn)
         nfinfo = self.getfinfo(newfn)
@@ -80,6 +131,55 @@ class FileInfoCache(object):
                 nfinfo[k] = v
         # nfinfo.update(ofinfo)
         ofinfo.clear()
+        # content keyed by inode stays with the file by itself, but content keyed by pathname has to be moved.
+        try:
+            nck = self.get_content_key(newfn)
+        except OSError:
+            return
+        if not isinstance(nck, tuple):
+            ock = os.path.realpath(oldfn)
+            ocinfo = self.content.pop(ock, None)
+            if ocinfo is not None:
+                self.content[nck] = ocinfo
+            owant = self.wanted.pop(ock, None)
+            if owant is not None:
+                self.wanted[nck] = owant
+        self._size_index_rename(oldfn, newfn)
+
+    def _size_index_rename(self, oldfn, newfn):
+        try:
+            st = os.stat(newfn)
+        except OSError:
+            return
+        isreg = S_ISREG(st.st_mode)
+        for fn, add in ((oldfn, False), (newfn, True)):
+            fpath, ftail = os.path.split(fn)
+            try:
+                dirkey = self.get_path_key(fpath)
+            except OSError:
+                continue
+            self._index_move(dirkey, st.st_size, ftail, add and isreg and ftail)
+        oldfn, newfn = os.path.abspath(oldfn), os.path.abspath(newfn)
+        for key in self._size_index_cache:
+            if key[0] == 'tree':
+                self._index_move(key, st.st_size, oldfn, isreg and newfn.startswith(os.path.join(key[1], '')) and newfn)
+
+    def _index_move(self, key, size, oldname, newname):
+        index = self._size_index_cache.get(key)
+        if index is None:
+            return
+        for size in (-1, size):
+            names = index.get(size, [])
+            if oldname in names:
+                names.remove(oldname)
+            if newname:
+                index.setdefault(size, []).append(newname)
+            for digestindex in self._digest_index_cache.get((key, size), {}).values():
+                for names in digestindex.values():
+                    if oldname in names:
+                        names.remove(oldname)
+                if newname:
+                    digestindex[None].append(newname)
 
     def nocase_dirfiles(self, dir, match):
         """return list of filenames in dir whose lowercase value equals match
@@ -100,6 +200,94 @@ class FileInfoCache(object):
             return d[match]
         return []
 
+    def size_index(self, dir):
+        """Return a map from size -> list of the regular files in dir with that size, or -1 -> all of them.
+
+        The dir is only listed and stat'ed once, and renames through this cache are kept track of.
+        """
+        dirkey = self.get_path_key(dir)
+        index = self._size_index_cache.get(dirkey)
+        if index is None:
+            index = {-1: []}
+            for a in osutil.listdir(dir):
+                try:
+                    st = os.stat(osutil.path_join(dir, a))
+                except OSError:
+                    continue
+                if S_ISREG(st.st_mode):
+                    index[-1].append(a)
+                    index.setdefault(st.st_size, []).append(a)
+            self._size_index_cache[dirkey] = index
+        return index
+
+    def tree_size_index(self, root, followlinks=False):
+        """Return a map from size -> list of the regular files anywhere under root with that size, or -1 -> all of them.
+
+        root must be an absolute path, and so are the returned names.  The tree is only walked once.
+        If followlinks is true, symlinks to dirs are walked too, but like with visit_dir in common.py, each dir only once.
+        """
+        key = ('tree', root)
+        index = self._size_index_cache.get(key)
+        if index is None:
+            index = {-1: []}
+            visited = set()
+            for dirpath, dirnames, filenames in os.walk(root, followlinks=followlinks):
+                if followlinks:
+                    try:
+                        st = os.stat(dirpath)
+                    except OSError:
+                        dirnames[:] = []
+                        continue
+                    if st.st_ino:
+                        if (st.st_dev, st.st_ino) in visited:
+                            dirnames[:] = []
+                            continue
+                        visited.add((st.st_dev, st.st_ino))
+                dirnames.sort()
+                for a in sorted(filenames):
+                    fn = os.path.join(dirpath, a)
+                    try:
+                        st = os.stat(fn)
+                    except OSError:
+                        continue
+                    if S_ISREG(st.st_mode):
+                        index[-1].append(fn)
+                        index.setdefault(st.st_size, []).append(fn)
+            self._size_index_cache[key] = index
+        return index
+
+    def digest_index(self, dir, size, typename, getdigest, tree=False, prefilter=None, followlinks=False):
+        """Return a map from digest -> list of the regular files in dir with size (or any size, if -1) and that digest.
+
+        getdigest(filename) is called to find the digest of each file the first time it is needed, so that all
+        the files searched for in a dir can be matched with only one pass over the files there.
+        If tree is true, the files anywhere under dir are indexed instead, as in tree_size_index with followlinks.
+        If prefilter is given, only the files for which prefilter(filename) is true are digested, and the rest
+        are left for later searches.
+        """
+        if tree:
+            key, sizeindex, join = ('tree', dir), self.tree_size_index(dir, followlinks), lambda dir, a: a
+        else:
+            key, sizeindex, join = self.get_path_key(dir), self.size_index(dir), osutil.path_join
+        typeindexes = self._digest_index_cache.setdefault((key, size), {})
+        index = typeindexes.get(typename)
+        if index is None:
+            index = typeindexes[typename] = {None: list(sizeindex.get(size, []))}
+        pending = index[None]
+        if pending:
+            index[None] = []
+            for a in pending:
+                fn = join(dir, a)
+                try:
+                    if prefilter and not prefilter(fn):
+                        index[None].append(a)
+                        continue
+                    digest = getdigest(fn)
+                except EnvironmentError:
+                    continue
+                index.setdefault(digest, []).append(a)
+        return index
+
     _FINDFILE = 1
     _FINDDIR = 0
 
@@ -128,3 +316,146 @@ class FileInfoCache(object):
 
     def nocase_finddir(self, filename):
         return self.nocase_findfile(filename, self._FINDDIR)
+
+
+class HashStoreError(Exception):
+    pass
+
+
+class HashStore(object):
+    """Digests of files kept on disk between runs, in an sqlite database.
+
+    Files are keyed by (st_dev, st_ino, st_size, st_mtime_ns), so a file
+    that has been changed or replaced no longer matches what was stored for
+    it.  When there are more than maxfiles files, the least recently used
+    ones are forgotten.
+    """
+
+    def __init__(self, filename, maxfiles):
+        try:
+            import sqlite3
+        except ImportError as e:
+            raise HashStoreError(e)
+        self._errors = sqlite3.Error
+        self.maxfiles = maxfiles
+        try:
+            dirname = os.path.dirname(filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.db = sqlite3.connect(filename, timeout=30)
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, used INTEGER, UNIQUE (dev, ino))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_used ON files (used)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS digests (file INTEGER, name TEXT, digest BLOB, PRIMARY KEY (file, name))')
+            self.clock = self.db.execute('SELECT max(used) FROM files').fetchone()[0] or 0
+        except (EnvironmentError, sqlite3.Error) as e:
+            raise HashStoreError('%s: %s' % (filename, e))
+        self.changes = 0
+
+    def _tick(self):
+        # "used" counts accesses instead of holding a time, so that the order is exact even when the clock isn't.
+        self.clock += 1
+        self.changes += 1
+        return self.clock
+
+    def _find(self, dev, ino):
+        return self.db.execute('SELECT id, size, mtime_ns FROM files WHERE dev = ? AND ino = ?', (dev, ino)).fetchone()
+
+    def get(self, key):
+        """Return a mapping of hash name -> digest of the file with the given stat key."""
+        dev, ino, size, mtime_ns = key
+        try:
+            row = self._find(dev, ino)
+            if row is None or row[1:] != (size, mtime_ns):
+                return {}
+            self.db.execute('UPDATE files SET used = ? WHERE id = ?', (self._tick(), row[0]))
+            digests = dict(self.db.execute('SELECT name, digest FROM digests WHERE file = ?', (row[0],)))
+        except (OverflowError, self._errors) as e:
+            raise HashStoreError(e)
+        self._maybecommit()
+        return digests
+
+    def put(self, key, digests):
+        """Store digests, a mapping of hash name -> digest, of the file with the given stat key."""
+        dev, ino, size, mtime_ns = key
+        try:
+            row = self._find(dev, ino)
+            if row is None:
+                fileid = self.db.execute('INSERT INTO files (dev, ino, size, mtime_ns, used) VALUES (?, ?, ?, ?, ?)', (dev, ino, size, mtime_ns, self._tick())).lastrowid
+            else:
+                fileid = row[0]
+                if row[1:] != (size, mtime_ns):
+                    self.db.execute('DELETE FROM digests WHERE file = ?', (fileid,))
+                self.db.execute('UPDATE files SET size = ?, mtime_ns = ?, used = ? WHERE id = ?', (size, mtime_ns, self._tick(), fileid))
+            self.db.executemany('INSERT OR REPLACE INTO digests (file, name, digest) VALUES (?, ?, ?)', [(fileid, name, digest) for name, digest in digests.items()])
+        except (OverflowError, self._errors) as e:
+            raise HashStoreError(e)
+        self._maybecommit()
+
+    def _maybecommit(self):
+        # commit every so often, so that other cfv processes sharing the database aren't locked out for long.
+        if self.changes >= 1000:
+            self.commit()
+
+    def commit(self):
+        try:
+            excess = self.db.execute('SELECT count(*) FROM files').fetchone()[0] - self.maxfiles
+            if excess > 0:
+                lru = 'SELECT id FROM files ORDER BY used LIMIT %i' % excess
+                self.db.execute('DELETE FROM digests WHERE file IN (%s)' % lru)
+                self.db.execute('DELETE FROM files WHERE id IN (%s)' % lru)
+            self.db.commit()
+        except self._errors as e:
+            raise HashStoreError(e)
+        self.changes = 0
+
+    def close(self):
+        try:
+            self.commit()
+        finally:
+            self.db.close()
+
+
+XATTR_PREFIX = 'user.cfv.'
+_XATTR_STAMP = XATTR_PREFIX + 'stamp'
+
+
+def _xattrstamp(key):
+    return ('%i %i' % (key[2], key[3])).encode('ascii')
+
+
+def getxattrdigests(filename, key):
+    """Return a mapping of hash name -> digest kept in the extended attributes of filename, if they were stored for the given stat key."""
+    if not hasattr(os, 'getxattr'):
+        return {}
+    try:
+        if os.getxattr(filename, _XATTR_STAMP) != _xattrstamp(key):
+            return {}
+        return dict((attr[len(XATTR_PREFIX):], os.getxattr(filename, attr)) for attr in os.listxattr(filename) if attr.startswith(XATTR_PREFIX) and attr != _XATTR_STAMP)
+    except EnvironmentError:  # no attributes, or not supported by the filesystem
+        return {}
+
+
+def putxattrdigests(filename, key, digests):
+    """Keep digests in the extended attributes of filename, stamped with the size and mtime from the given stat key."""
+    if not hasattr(os, 'setxattr'):
+        return
+    stamp = _xattrstamp(key)
+    try:
+        st = os.stat(filename)
+        if (st.st_size, st.st_mtime_ns) != key[2:]:
+            return
+        try:
+            fresh = os.getxattr(filename, _XATTR_STAMP) == stamp
+        except EnvironmentError:
+            fresh = False
+        if not fresh:
+            # the stamp goes first and comes back last, so that digests of the old contents are never taken as current.
+            for attr in os.listxattr(filename):
+                if attr.startswith(XATTR_PREFIX):
+                    os.removexattr(filename, attr)
+        for name, digest in digests.items():
+            os.setxattr(filename, XATTR_PREFIX + name, digest)
+        if not fresh:
+            os.setxattr(filename, _XATTR_STAMP, stamp)
+    except EnvironmentError:  # read only, or not supported by the filesystem
+        pass
@@ -1,44 +1,62 @@
 import re
 
+from cfv import fileutil
 
+
+# checksum file types by name.  Lazily registered types are None until they are first used.
 _cftypes = {}
+_cftype_loaders = {}
 _user_cf_fn_regexs = []
 _cf_fn_exts, _cf_fn_matches, _cf_fn_searches = [], [], []
 _cftypes_match_order = []
 
 
 def add_user_cf_fn_regex(match, typename):
-    _user_cf_fn_regexs.append((re.compile(match, re.I).search, get_handler(typename)))
+    _user_cf_fn_regexs.append((re.compile(match, re.I).search, typename))
 
 
 def auto_filename_match(*names):
-    for searchfunc, cftype in _user_cf_fn_regexs + _cf_fn_matches + _cf_fn_exts + _cf_fn_searches:
+    for searchfunc, typename in _user_cf_fn_regexs + _cf_fn_matches + _cf_fn_exts + _cf_fn_searches:
         for name in names:
             if searchfunc(name):
-                return cftype
+                return get_handler(typename)
     return None
 
 
 def auto_chksumfile_match(file):
-    for cftype in _cftypes_match_order:
-        if cftype.auto_chksumfile_match(file):
-            return cftype
+    head = fileutil.PeekHead(file)
+    for order, typename, matchfunc in _cftypes_match_order:
+        if (matchfunc or get_handler(typename).auto_chksumfile_match)(head):
+            return get_handler(typename)
     return None
 
 
+def _register_matches(typename, filename_match, chksumfile_order, chksumfile_match):
+    if filename_match:
+        if filename_match[-1] == '$' and filename_match[0] == '^':
+            _cf_fn_matches.append((re.compile(filename_match, re.I).search, typename))
+        elif filename_match[-1] == '$':
+            _cf_fn_exts.append((re.compile(filename_match, re.I).search, typename))
+        else:
+            _cf_fn_searches.append((re.compile(filename_match, re.I).search, typename))
+
+    _cftypes_match_order.append((chksumfile_order, typename, chksumfile_match))
+    _cftypes_match_order.sort(key=lambda t: t[0], reverse=True)
+
+
 def register_cftype(cftype):
     _cftypes[cftype.name] = cftype
+    _register_matches(cftype.name, getattr(cftype, 'auto_filename_match', None), getattr(cftype, 'auto_chksumfile_order', 0), cftype.auto_chksumfile_match)
 
-    if hasattr(cftype, 'auto_filename_match'):
-        if cftype.auto_filename_match[-1] == '$' and cftype.auto_filename_match[0] == '^':
-            _cf_fn_matches.append((re.compile(cftype.auto_filename_match, re.I).search, cftype))
-        elif cftype.auto_filename_match[-1] == '$':
-            _cf_fn_exts.append((re.compile(cftype.auto_filename_match, re.I).search, cftype))
-        else:
-            _cf_fn_searches.append((re.compile(cftype.auto_filename_match, re.I).search, cftype))
 
-    _cftypes_match_order.append(cftype)
-    _cftypes_match_order.sort(key=lambda t: (getattr(t, 'auto_chksumfile_order', 0), cftype.name), reverse=True)
+def register_lazy_cftype(name, loader, auto_filename_match=None, auto_chksumfile_order=0, auto_chksumfile_match=None):
+    """Register a checksum file type whose class is only made by calling loader when it is first used.
+
+    If auto_chksumfile_match is not given, the type is loaded to try matching a checksum file against it.
+    """
+    _cftypes[name] = None
+    _cftype_loaders[name] = loader
+    _register_matches(name, auto_filename_match, auto_chksumfile_order, auto_chksumfile_match)
 
 
 def get_handler_names():
@@ -46,7 +64,10 @@ def get_handler_names():
 
 
 def get_handler(name):
-    return _cftypes[name]
+    cftype = _cftypes[name]
+    if cftype is None:
+        cftype = _cftypes[name] = _cftype_loaders[name]()
+    return cftype
 
 
 def has_handler(name):
@@ -32,11 +32,14 @@ __homepage__ = 'https://github.com/cfv-project/cfv'
 import copy
 import errno
 import getopt
+import itertools
 import os
 import re
+import shutil
 import struct
 import sys
 import time
+from collections import OrderedDict
 from stat import S_ISDIR, S_ISREG
 
 from cfv import caching
@@ -44,9 +47,9 @@ from cfv import cftypes
 from cfv import fileutil
 from cfv import hash
 from cfv import osutil
+from cfv import parallel
 from cfv import strutil
 from cfv import ui
-from cfv.BitTorrent import bencode, btformats
 
 
 def cfencode(s, preferred=None):
@@ -74,6 +77,8 @@ class Data(object):
 
 
 curdir = osutil.getcwdu()
+# the dir searched under by --search=tree
+searchroot = curdir
 reldir = ['']
 prevdir = []
 
@@ -140,23 +145,147 @@ class FileNameFilter(object):
         return fn in self.testfiles
 
 
-def getfilehash(filename, hashname, hashfunc):
-    finfo = cache.getfinfo(filename)
-    if hashname not in finfo:
+def want_hashes(hashers):
+    """Request that hashers (name -> hasher) are also calculated whenever a file has to be read.
+    """
+    wanted_hashes.update(hashers)
+
+
+def usestore(method, *args):
+    """Call a method of the persistent hash cache, turning the cache off if it fails."""
+    global hashstore
+    try:
+        return method(*args)
+    except caching.HashStoreError as e:
+        view.perror('cfv: hash cache: %s' % e)
+        hashstore = None
+
+
+def openhashstore():
+    global hashstore
+    if config.hashcache != 'off':
+        try:
+            hashstore = caching.HashStore(config.gethashcachefile(), config.hashcache_size)
+        except caching.HashStoreError as e:
+            view.perror('cfv: hash cache: %s' % e)
+
+
+def closehashstore():
+    if hashstore:
+        usestore(hashstore.close)
+
+
+def getstored(filename, cinfo, names):
+    """Fill in cinfo from the extended attributes of filename or the persistent hash cache, if they have all of names for filename as it is now.
+
+    Returns the stat key to store newly calculated digests of filename under, or None.
+    """
+    if not (hashstore or config.xattr_cache != 'off') or not filename:
+        return None
+    try:
+        st = os.stat(filename)
+    except EnvironmentError:
+        return None
+    if not S_ISREG(st.st_mode):
+        return None
+    key = parallel.statkey(st)
+    if names:
+        stored = {}
+        if config.xattr_cache != 'off':
+            stored = caching.getxattrdigests(filename, key)
+        if hashstore and config.hashcache == 'trust' and not all(name in stored for name in names):
+            stored.update(usestore(hashstore.get, key) or {})
+        if all(name in stored for name in names):
+            cinfo.update(stored)
+            cinfo['size'] = st.st_size
+    return key
+
+
+def putstored(filename, key, digests):
+    # a file changed again within the granularity of its mtime would keep the same key, so recently modified files aren't stored.
+    if not key or time.time() - key[3] / 1e9 < 2:
+        return
+    if config.xattr_cache == 'write':
+        caching.putxattrdigests(filename, key, digests)
+    if hashstore:
+        usestore(hashstore.put, key, digests)
+
+
+def getfilehashes(filename, hashers, sinks=()):
+    cinfo = cache.getcinfo(filename)
+    want = dict((name, hasher) for name, hasher in hashers.items() if name not in cinfo)
+    key = None
+    if want or sinks:
+        key = getstored(filename, cinfo, not sinks and want)
+        want = dict((name, hasher) for name, hasher in want.items() if name not in cinfo)
+    if want or sinks:
+        # since the file has to be read anyway, calculate everything else that will be needed in the same pass.
+        for name, hasher in list(wanted_hashes.items()) + list(cache.getwanted(filename).items()):
+            if name not in cinfo:
+                want[name] = hasher
         if view.progress:
             view.progress.init(filename)
         try:
-            hash, size = hashfunc(filename, view.progress and view.progress.update or None)
+            callback = view.progress and view.progress.update or None
+            if config.jobs > 1 and list(want) == ['crc'] and not sinks and filename and os.path.getsize(filename) >= parallel.CRC_RANGES_MIN:
+                # unlike the other hashes, crc32 of a single large file can be split up between threads.
+                digests = {}
+                digests['crc'], size = parallel.getfilecrc(filename, config.jobs, callback, config.getreader())
+            else:
+                digests, size = hash.getfilechecksums(filename, want, callback, sinks, config.getreader())
         finally:
             if view.progress:
                 view.progress.cleanup()
-        finfo[hashname], finfo['size'] = hash, size
+        cinfo.update(digests)
+        cinfo['size'] = size
         stats.bytesread += size
-    return finfo[hashname], finfo['size']
+        putstored(filename, key, digests)
+    return cinfo
+
+
+def getfilehash(filename, hashname, hasher):
+    cinfo = getfilehashes(filename, {hashname: hasher})
+    return cinfo[hashname], cinfo['size']
 
 
 def getfilecrc(filename):
-    return getfilehash(filename, 'crc', hash.getfilecrc)
+    return getfilehash(filename, 'crc', hash.CRC32)
+
+
+PREFIX_SIZE = 16384
+
+
+def getfileprefixmd5(filename):
+    """Return the md5 of the first 16KiB of filename (or all of it, if smaller), like the md5_16k of par and par2 files."""
+    cinfo = cache.getcinfo(filename)
+    digest = cinfo.get('md5_16k')
+    if digest is None:
+        m = hash.md5()
+        stats.bytesread += config.getreader().feedfile(filename, [m], None, PREFIX_SIZE)
+        digest = cinfo['md5_16k'] = m.digest()
+    return digest
+
+
+def store_prefetched(filename, digests, size, key):
+    """Put digests calculated by a worker into the cache.
+
+    Returns false if filename may no longer be the file that the worker read.
+    """
+    try:
+        st = os.stat(filename)
+        if parallel.statkey(st) != key:
+            return False
+        cinfo = cache.getcinfo(filename, st)
+    except EnvironmentError:
+        return False
+    new = [name for name in digests if name not in cinfo]
+    if new:
+        for name in new:
+            cinfo[name] = digests[name]
+        cinfo['size'] = size
+        stats.bytesread += size
+        putstored(filename, key, digests)
+    return True
 
 
 def rename(oldfn, newfn):
@@ -257,6 +386,16 @@ class Config(object):
     piece_size_pow2 = 18
     private_torrent = False
     encoding = 'auto'
+    jobs = 1
+    pool = 'thread'
+    blocksize = hash.DEFAULT_BLOCKSIZE
+    archival = 0
+    io = 'mmap'
+    hashcache = 'off'
+    hashcache_file = ''
+    hashcache_size = 1000000
+    xattr_cache = 'off'
+    update = 0
 
     def getencoding(self, preferred=None):
         return osutil.getencoding(self.encoding, preferred)
@@ -264,6 +403,14 @@ class Config(object):
     def getencodeerrors(self, default=None):
         return osutil.getencodeerrors(self.encoding, default=default)
 
+    def gethashcachefile(self):
+        if self.hashcache_file:
+            return os.path.expanduser(self.hashcache_file)
+        return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')), 'cfv', 'hashes.sqlite')
+
+    def getreader(self):
+        return hash.Reader(self.blocksize, self.archival, self.io)
+
     def setencoding(self, v):
         if v in ('raw', 'auto'):
             pass
@@ -315,10 +462,28 @@ class Config(object):
     def setx(self, o, v):
         if o == 'default':
             self.setdefault(v)
-        elif o in ('dirsort', 'cmdlinesort', 'ignorecase', 'rename', 'search', 'dereference', 'unquote', 'private_torrent'):
+        elif o in ('dirsort', 'cmdlinesort', 'ignorecase', 'rename', 'dereference', 'unquote', 'private_torrent', 'archival'):
             self.setbool(o, v)
         elif o in ('cmdlineglob', 'progress'):
             self.setyesnoauto(o, v)
+        elif o == 'update':
+            try:
+                self.setbool(o, v)
+            except CFVValueError:
+                if v.lower() == 'changed':
+                    self.update = 2
+                else:
+                    raise CFVValueError("invalid update option '%s', must be 'changed' or a bool" % v)
+        elif o == 'search':
+            try:
+                self.setbool(o, v)
+            except CFVValueError:
+                if v.lower() == 'dir':
+                    self.search = 1
+                elif v.lower() == 'tree':
+                    self.search = 2
+                else:
+                    raise CFVValueError("invalid search option '%s', must be 'dir', 'tree' or a bool" % v)
         elif o == 'verbose':
             try:
                 self.setintr(o, v, -3, 1)
@@ -401,6 +566,30 @@ class Config(object):
             self.setstr(o, v)
         elif o == 'piece_size_pow2':
             self.setintr(o, v, 1, 30)
+        elif o == 'jobs':
+            self.setintr(o, v, 1, 1024)
+        elif o == 'blocksize':
+            self.setintr(o, v, 512, 2 ** 30)
+        elif o == 'pool':
+            if v not in parallel.BACKENDS:
+                raise CFVValueError("invalid pool option '%s', must be %s" % (v, ' or '.join(parallel.BACKENDS)))
+            self.pool = v
+        elif o == 'io':
+            if v not in hash.IO_MODES:
+                raise CFVValueError("invalid io option '%s', must be %s" % (v, ', '.join(hash.IO_MODES)))
+            self.io = v
+        elif o == 'hashcache':
+            if v not in ('off', 'update', 'trust'):
+                raise CFVValueError("invalid hashcache option '%s', must be off, update, or trust" % v)
+            self.hashcache = v
+        elif o == 'xattr_cache':
+            if v not in ('off', 'read', 'write'):
+                raise CFVValueError("invalid xattr_cache option '%s', must be off, read, or write" % v)
+            self.xattr_cache = v
+        elif o == 'hashcache_file':
+            self.setstr(o, v)
+        elif o == 'hashcache_size':
+            self.setintr(o, v, 1, 2 ** 62)
         else:
             raise CFVNameError("invalid option '%s'" % o)
 
@@ -461,6 +650,12 @@ def parse_commentline(comment, commentchars):
 
 
 class ChksumType(object):
+    pipeline = None
+    # if set, parsing the checksum file passes its entries to collect(filename, filecrc, filesize, prefixmd5) instead of testing them, and doesn't count or report anything.
+    collect = None
+    # whether make can update an existing checksum file of this type (and plan_tests plan it), by reading its entries with do_test_chksumlines
+    updatable = False
+
     def test_chksumfile(self, file, filename):
         if config.showunverified:  # we can't expect the checksum file itself to be checksummed
             cache.set_verified(filename)
@@ -478,7 +673,7 @@ class ChksumType(object):
     def do_test_chksumfile_print_testingline(self, file, comment=None):
         view.ev_test_cf_begin(self.name, file.name, comment)
 
-    def search_file(self, filename, filecrc, filesize, errfunc, errargs):
+    def search_file(self, filename, filecrc, filesize, errfunc, errargs, prefixmd5=None):
         if not config.search or (filesize < 0 and (not filecrc or not config.docrcchecks)):  # don't bother searching if we don't have anything to compare against
             errfunc(*errargs)
             return -2
@@ -491,27 +686,34 @@ class ChksumType(object):
                     filename = osutil.path_join(fpath, filenametail)  # fix the dir the orig filename is in, so that the do_f_found can rename it correctly
             else:
                 fpath = osutil.curdiru
-            ftails = osutil.listdir(fpath)
+            if config.search == 2:
+                searchdir, tree = searchroot, True
+            else:
+                searchdir, tree = fpath, False
+            if config.docrcchecks and filecrc is not None:
+                # if the checksum file has the md5 of the start of the file, candidates that don't start the same are passed over after reading only that much.
+                prefilter = prefixmd5 and (lambda fn: getfileprefixmd5(fn) == prefixmd5)
+                ftails = cache.digest_index(searchdir, max(filesize, -1), self.name, self.search_digest, tree, prefilter, config.dereference).get(filecrc, [])
+                filecrct = strutil.hexlify(filecrc)
+            elif tree:
+                ftails = cache.tree_size_index(searchdir, config.dereference).get(max(filesize, -1), [])
+                filecrct = 'exists'
+            else:
+                ftails = cache.size_index(fpath).get(max(filesize, -1), [])
+                filecrct = 'exists'
+            if tree:
+                # the tree index has absolute paths, make them relative to the current dir and try the ones in fpath first.
+                ftails = [os.path.relpath(fn) for fn in ftails]
+                # relpath gives the names of files in the current dir without a dir.
+                samedir = os.path.normpath(fpath)
+                if samedir == os.curdir:
+                    samedir = ''
+                ftails.sort(key=lambda fn: os.path.dirname(fn) != samedir)
+                fpath = ''
         except EnvironmentError:
             ftails = []
         for ftail in ftails:
             fn = osutil.path_join(fpath, ftail)
-            try:
-                if filesize >= 0:
-                    fs = os.path.getsize(fn)
-                    if fs != filesize:
-                        continue
-                if config.docrcchecks and filecrc is not None:
-                    c = self.do_test_file(fn, filecrc)
-                    if c:
-                        continue
-                    filecrct = strutil.hexlify(filecrc)
-                else:
-                    if not os.path.isfile(fn):
-                        continue
-                    filecrct = 'exists'
-            except EnvironmentError:
-                continue
             if cache.has_flag(fn, '_ok'):
                 alreadyok = (fn, filecrct)
                 continue
@@ -525,10 +727,62 @@ class ChksumType(object):
         errfunc(*errargs)
         return -1
 
-    def test_file(self, filename, filecrc, filesize=-1):
+    def search_digest(self, filename):
+        # do_test_file returns the digest of a file that doesn't match.
+        return self.do_test_file(filename, None)
+
+    def defer(self, func, *args):
+        """Call func, after any files queued in the pipeline have been reported."""
+        if self.collect:
+            return
+        if self.pipeline:
+            self.pipeline.add(lambda result: func(*args))
+        else:
+            func(*args)
+
+    def test_file(self, filename, filecrc, filesize=-1, prefixmd5=None):
+        """Test filename against filecrc and filesize.
+
+        prefixmd5 is the md5 of the first 16KiB of the file, if the checksum file has it, for searching.
+        """
         filename = self.mangle_filename(filename)
         if not filenamefilter.should_test(filename):
             return
+        if self.collect:
+            return self.collect(filename, filecrc, filesize, prefixmd5)
+        if self.pipeline:
+            return self.queue_test_file(filename, filecrc, filesize, prefixmd5)
+        return self.test_mangled_file(filename, filecrc, filesize, prefixmd5)
+
+    def queue_test_file(self, filename, filecrc, filesize, prefixmd5=None):
+        names = []
+        if config.docrcchecks and filecrc:
+            try:
+                cinfo = cache.getcinfo(filename)
+            except EnvironmentError:
+                cinfo = None
+            if cinfo is not None:
+                getstored(filename, cinfo, [name for name in self.hashers if name not in cinfo])
+                names = [name for name in set(self.hashers).union(wanted_hashes, cache.getwanted(filename)) if name not in cinfo]
+
+        def test_prefetched(result):
+            if result and store_prefetched(filename, *result) and len(self.hashers) == 1:
+                digests = result[0]
+                (hashname,) = self.hashers
+                if not config.ignorecase and digests.get(hashname) == filecrc:
+                    # the worker found the file ok, so skip straight to reporting it.
+                    stats.num += 1
+                    if config.showunverified:
+                        cache.set_verified(filename)
+                    self.do_f_ok(filename, filesize, strutil.hexlify(filecrc))
+                    return
+            self.test_mangled_file(filename, filecrc, filesize, prefixmd5)
+        if names:
+            self.pipeline.add(test_prefetched, filename, names, filesize, config.jobs, config.getreader())
+        else:
+            self.pipeline.add(test_prefetched)
+
+    def test_mangled_file(self, filename, filecrc, filesize=-1, prefixmd5=None):
         stats.num += 1
         l_filename = filename
         try:
@@ -537,14 +791,14 @@ class ChksumType(object):
                 fs = os.path.getsize(l_filename)
                 if fs != filesize:
                     self.search_file(filename, filecrc, filesize,
-                                     self.do_f_badsize, (l_filename, filesize, fs))
+                                     self.do_f_badsize, (l_filename, filesize, fs), prefixmd5)
                     return -2
             if config.docrcchecks and filecrc:
                 c = self.do_test_file(l_filename, filecrc)
                 filecrct = strutil.hexlify(filecrc)
                 if c:
                     self.search_file(filename, filecrc, filesize,
-                                     self.do_f_badcrc, (l_filename, 'crc does not match (%s!=%s)' % (filecrct, strutil.hexlify(c))))
+                                     self.do_f_badcrc, (l_filename, 'crc does not match (%s!=%s)' % (filecrct, strutil.hexlify(c))), prefixmd5)
                     return -2
             else:
                 if not os.path.exists(l_filename):
@@ -554,7 +808,7 @@ class ChksumType(object):
                 filecrct = 'exists'  # since we didn't actually test the crc, make verbose mode merely say it exists
         except (EnvironmentError, UnicodeError) as a:  # UnicodeError can occur if python can't map the filename to the filesystem's encoding
             self.search_file(filename, filecrc, filesize,
-                             self.do_f_enverror, (l_filename, a))
+                             self.do_f_enverror, (l_filename, a), prefixmd5)
             return -1
         self.do_f_ok(l_filename, filesize, filecrct)
 
@@ -674,7 +928,8 @@ class ChksumType(object):
     def mangle_filename(self, filename):
         if config.unquote and len(filename) > 1 and filename[0] == '"' and filename[-1] == '"':
             filename = filename[1:-1]  # work around buggy sfv encoders that quote filenames
-            stats.quoted += 1
+            if not self.collect:
+                stats.quoted += 1
         if config.fixpaths:
             filename = self.fixpath(filename)
         filename = os.path.normpath(filename)
@@ -697,22 +952,85 @@ class ChksumType(object):
 
 
 class TextChksumType(ChksumType):
+    updatable = True
+
     def do_test_chksumfile(self, file):
         self.do_test_chksumfile_print_testingline(file)
+        if config.jobs > 1 and config.docrcchecks and getattr(self, 'hashers', None):
+            # the files are read and hashed by a pool of workers, while the results are still checked and reported here in order.
+            if config.pool == 'process':
+                batchsize = 64  # keep the overhead of talking to the processes small compared to the work each batch does
+            else:
+                batchsize = 1
+            self.pipeline = parallel.Pipeline(parallel.get_executor(config.jobs, config.pool), parallel.hashfile, config.jobs * batchsize * 4, batchsize)
+        try:
+            self.do_test_chksumlines(file)
+            if self.pipeline:
+                self.pipeline.flush()
+        except Exception:
+            if self.pipeline:
+                self.pipeline.flush()
+            raise
+        except BaseException:
+            if self.pipeline:
+                self.pipeline.cancel()
+            raise
+        finally:
+            self.pipeline = None
+
+    # types can set _bulkrem to a multiline regex matching a whole valid line, with the same groups as do_test_chksumentry expects.
+    _bulkrem = None
+
+    def do_test_chksumlines(self, file):
+        if self._bulkrem is not None:
+            return self.do_test_chksumblocks(file)
         line_number = 0
         while 1:
             line_number += 1
             try:
                 line = file.readline()
             except UnicodeError as e:
-                stats.cferror += 1
-                view.ev_test_cf_lineencodingerror(file.name, line_number, e)
+                self.line_error(view.ev_test_cf_lineencodingerror, file.name, line_number, e)
                 continue
             if not line:
                 break
             if self.do_test_chksumline(line):
-                stats.cferror += 1
-                view.ev_test_cf_unrecognized_line(file.name, line_number)
+                self.line_error(view.ev_test_cf_unrecognized_line, file.name, line_number)
+
+    def do_test_chksumblocks(self, file):
+        # parse large blocks of the file at once, only going line by line for the lines the bulk regex doesn't match.
+        line_number = 0
+        while 1:
+            block = file.readblock()
+            if not block:
+                break
+            if not file.isplainblock(block):
+                line_number = self.do_test_blocklines(file, file.blocklines(block), line_number)
+                continue
+            pos = 0
+            for x in self._bulkrem.finditer(block):
+                start = x.start()
+                if start > pos:
+                    line_number = self.do_test_blocklines(file, fileutil.plainlines(block[pos:start]), line_number)
+                line_number += 1
+                self.do_test_chksumentry(x)
+                pos = x.end()
+            if pos < len(block):
+                line_number = self.do_test_blocklines(file, fileutil.plainlines(block[pos:]), line_number)
+
+    def do_test_blocklines(self, file, lines, line_number):
+        for line in lines:
+            line_number += 1
+            if isinstance(line, UnicodeError):
+                self.line_error(view.ev_test_cf_lineencodingerror, file.name, line_number, line)
+            elif self.do_test_chksumline(line):
+                self.line_error(view.ev_test_cf_unrecognized_line, file.name, line_number)
+        return line_number
+
+    def line_error(self, evfunc, *args):
+        if not self.collect:
+            stats.cferror += 1
+            self.defer(evfunc, *args)
 
     @staticmethod
     def filename_ok(fn):
@@ -730,38 +1048,47 @@ class FooSum_Base(TextChksumType):
         x = self._foosum_rem.match(line)
         if not x:
             return -1
-        if x.group(2) == ' ':
+        self.do_test_chksumentry(x)
+
+    def do_test_chksumentry(self, x):
+        if x.group(2) == ' ' and not self.collect:
             if stats.textmode == 0:
-                view.ev_generic_warning('file(s) tested in textmode')
+                self.defer(view.ev_generic_warning, 'file(s) tested in textmode')
             stats.textmode += 1
         self.test_file(x.group(3), strutil.unhexlify(x.group(1)))
 
 
+def gnu_sum_match(hexlen, _autorem=re.compile(r'([0-9a-fA-F]+) [ *].')):
+    def auto_chksumfile_match(file):
+        line = file.peekline(4096)
+        while line:
+            if line[0] not in ';#':
+                x = _autorem.match(line)
+                return x is not None and len(x.group(1)) == hexlen
+            line = file.peeknextline(4096)
+    return auto_chksumfile_match
+
+
 def gnu_sum(algo):
-    hasher, digestlen = hash.getfilechecksumgeneric(algo)
-    hexlen = digestlen * 2
+    hasher = hash.gethasher(algo)
+    hexlen = hasher().digest_size * 2
 
     class GnuSum_Base(FooSum_Base):
         name = algo
         description = 'GNU %ssum' % algo
         descinfo = '%s,name' % algo.upper()
+        hashers = {algo: hasher}
 
         def do_test_file(self, filename, filecrc):
             c = getfilehash(filename, algo, hasher)[0]
             if c != filecrc:
                 return c
 
-        @staticmethod
-        def auto_chksumfile_match(file, _autorem=re.compile(r'[0-9a-fA-F]{%d} [ *].' % hexlen)):
-            line = file.peekline(4096)
-            while line:
-                if line[0] not in ';#':
-                    return _autorem.match(line) is not None
-                line = file.peeknextline(4096)
-
+        auto_chksumfile_match = staticmethod(gnu_sum_match(hexlen))
         auto_filename_match = algo
 
         _foosum_rem = re.compile(r'([0-9a-fA-F]{%s}) ([ *])([^\r\n]+)[\r\n]*$' % hexlen)
+        _bulkrem = re.compile(r'^([0-9a-fA-F]{%s}) ([ *])([^\r\n]+)\r{0,2}(?:\n|\Z)' % hexlen, re.M)
 
         @staticmethod
         def make_std_filename(filename):
@@ -774,42 +1101,24 @@ def gnu_sum(algo):
     return GnuSum_Base
 
 
-try:
-    cftypes.register_cftype(gnu_sum('sha512'))
-except (ImportError, ValueError):
-    pass
-
-try:
-    cftypes.register_cftype(gnu_sum('sha384'))
-except (ImportError, ValueError):
-    pass
-
-try:
-    cftypes.register_cftype(gnu_sum('sha256'))
-except (ImportError, ValueError):
-    pass
-
-try:
-    cftypes.register_cftype(gnu_sum('sha224'))
-except (ImportError, ValueError):
-    pass
+def register_gnu_sum(algo):
+    # the class and its regexes are only made when the type is used, but check up front that the hash is available.
+    hexlen = hash.gethasher(algo)().digest_size * 2
+    cftypes.register_lazy_cftype(algo, lambda: gnu_sum(algo), auto_filename_match=algo, auto_chksumfile_match=gnu_sum_match(hexlen))
 
-try:
-    cftypes.register_cftype(gnu_sum('sha1'))
-except (ImportError, ValueError):
-    pass
 
-try:
-    cftypes.register_cftype(gnu_sum('md5'))
-except (ImportError, ValueError):
-    pass
+for algo in ('sha512', 'sha384', 'sha256', 'sha224', 'sha1', 'md5'):
+    try:
+        register_gnu_sum(algo)
+    except (ImportError, ValueError):
+        pass
 
 
 # ---------- bsdmd5 ----------
 
 class MD5_MixIn(object):
-    def __init__(self):
-        self.hasher, _ = hash.getfilechecksumgeneric('md5')
+    hasher = hash.md5
+    hashers = {'md5': hash.md5}
 
     def do_test_file(self, filename, filecrc):
         c = getfilehash(filename, 'md5', self.hasher)[0]
@@ -829,11 +1138,15 @@ class BSDMD5(TextChksumType, MD5_MixIn):
     auto_filename_match = '^md5$'
 
     _bsdmd5rem = re.compile(r'MD5 \((.+)\) = ([0-9a-fA-F]{32})[\r\n]*$')
+    _bulkrem = re.compile(r'^MD5 \((.+)\) = ([0-9a-fA-F]{32})\r{0,2}(?:\n|\Z)', re.M)
 
     def do_test_chksumline(self, line):
         x = self._bsdmd5rem.match(line)
         if not x:
             return -1
+        self.do_test_chksumentry(x)
+
+    def do_test_chksumentry(self, x):
         self.test_file(x.group(1), strutil.unhexlify(x.group(2)))
 
     @staticmethod
@@ -901,7 +1214,7 @@ class PAR(ChksumType, MD5_MixIn):
                 stats.cferror += 1
                 view.ev_test_cf_filenameencodingerror(file.name, i, e)
                 continue
-            self.test_file(filename, md5, file_size)
+            self.test_file(filename, md5, file_size, md5_16k)
 
         if config.docrcchecks:
             while 1:
@@ -990,7 +1303,7 @@ class PAR2(ChksumType, MD5_MixIn):
                         stats.cferror += 1
                         view.ev_test_cf_filenameencodingerror(file.name, strutil.hexlify(file_id), e)
                         continue
-                    self.test_file(filename, file_md5, file_size)
+                    self.test_file(filename, file_md5, file_size, file_md5_16k)
             elif pkt_type == b'PAR 2.0\0Main\0\0\0\0':
                 if not config.docrcchecks:
                     d = file.read(pkt_len - pkt_header_size)
@@ -1033,6 +1346,7 @@ class Torrent(ChksumType):
         return file.peek(1) == b'd' and file.peek(4096).find(b'8:announce') >= 0
 
     def do_test_chksumfile(self, file):
+        from cfv.BitTorrent import bencode, btformats
         try:
             metainfo = bencode.bdecode(file.read())
             btformats.check_message(metainfo)
@@ -1135,6 +1449,9 @@ class Torrent(ChksumType):
             return
 
         curfh = Data(fh=None, f=None)
+        reader = config.getreader()
+        # each part of a piece is read into the start of this buffer, and hashed before the next part is read.
+        piecebuf = memoryview(bytearray(min(piecelen, total_len)))
 
         def readfpiece(f, pos, size):
             if f.l_filename is None:
@@ -1143,10 +1460,12 @@ class Torrent(ChksumType):
                 if not curfh.fh or curfh.f is not f:
                     if curfh.fh:
                         curfh.fh.close()
-                    curfh.fh = open(f.l_filename, 'rb')
+                    curfh.fh = reader.open(f.l_filename)
                     curfh.f = f
                 curfh.fh.seek(pos)
-                d = curfh.fh.read(size)
+                d = piecebuf[:size]
+                n = curfh.fh.readinto(d)
+                reader.drop(curfh.fh, pos, n)
             except EnvironmentError as e:
                 if not f.done:
                     if view.progress:
@@ -1154,8 +1473,8 @@ class Torrent(ChksumType):
                     self.do_f_enverror(f.l_filename, e)
                     f.done = 1
                 return None
-            stats.bytesread += len(d)
-            if len(d) < size:
+            stats.bytesread += n
+            if n < size:
                 return None
             return d
 
@@ -1241,49 +1560,26 @@ class Torrent(ChksumType):
         if config.announceurl is None:
             raise EnvironmentError('announce url required')
         file = fileutil.open_write(filename, config, force_raw=True)
-        self.sh = hash.sha1()
         self.files = []
-        self.pieces = []
-        self.piece_done = 0
         self.piece_length = 2 ** config.piece_size_pow2
+        self.piecehasher = hash.PieceHasher(self.piece_length)
         return file
 
     def make_addfile(self, filename):
-        firstpiece = len(self.pieces)
-        with open(filename, 'rb') as f:
-            if view.progress:
-                view.progress.init(filename)
-            fs = 0
-            while 1:
-                piece_left = self.piece_length - self.piece_done
-                d = f.read(piece_left)
-                if not d:
-                    break
-                self.sh.update(d)
-                s = len(d)
-                stats.bytesread += s
-                fs += s
-                if view.progress:
-                    view.progress.update(fs)
-                self.piece_done += s
-                if self.piece_done == self.piece_length:
-                    self.pieces.append(self.sh.digest())
-                    self.sh = hash.sha1()
-                    self.piece_done = 0
-        if view.progress:
-            view.progress.cleanup()
+        if filename == '':
+            raise EnvironmentError(errno.EINVAL, 'cannot add stdin to a torrent')
+        firstpiece = len(self.piecehasher.pieces)
+        # the pieces span file boundaries, so the data is always fed through, but any other wanted hashes get filled in by the same read.
+        fs = getfilehashes(filename, {}, [self.piecehasher])['size']
 
         def cfencode_utf8pref(s):
             return cfencode(s, 'UTF-8')
 
         self.files.append({b'length': fs, b'path': list(map(cfencode_utf8pref, osutil.path_split(filename)))})
-        return ('pieces %i..%i' % (firstpiece, len(self.pieces)), fs), ''
+        return ('pieces %i..%i' % (firstpiece, len(self.piecehasher.pieces)), fs), ''
 
     def make_chksumfile_finish(self, file):
-        if self.piece_done > 0:
-            self.pieces.append(self.sh.digest())
-
-        info = {b'pieces': b''.join(self.pieces), b'piece length': self.piece_length}
+        info = {b'pieces': b''.join(self.piecehasher.finish()), b'piece length': self.piece_length}
         if config.private_torrent:
             info[b'private'] = 1
         if len(self.files) == 1 and len(self.files[0][b'path']) == 1:
@@ -1303,6 +1599,7 @@ class Torrent(ChksumType):
             info[b'files'] = self.files
             info[b'name'] = commonroot
 
+        from cfv.BitTorrent import bencode, btformats
         btformats.check_info(info)
         data = {b'info': info, b'announce': cfencode(config.announceurl.strip(), 'UTF-8'), b'creation date': int(time.time())}
         if config.encoding != 'raw':
@@ -1319,6 +1616,8 @@ cftypes.register_cftype(Torrent)
 # ---------- sfv ----------
 
 class CRC_MixIn(object):
+    hashers = {'crc': hash.CRC32}
+
     def do_test_file(self, filename, filecrc):
         c = getfilecrc(filename)[0]
         if c != filecrc:
@@ -1338,6 +1637,9 @@ class SFV_Base(TextChksumType):
         x = self._sfvrem.match(line)
         if not x:
             return -1
+        self.do_test_chksumentry(x)
+
+    def do_test_chksumentry(self, x):
         self.test_file(x.group(1), strutil.unhexlify(x.group(2)))
 
     def make_chksumfile_create(self, filename):
@@ -1361,6 +1663,7 @@ class SFV(SFV_Base, CRC_MixIn):
     auto_filename_match = 'sfv$'
 
     _sfvrem = re.compile(r'(.+) ([0-9a-fA-F]{8})[\r\n]*$')
+    _bulkrem = re.compile(r'^(?!;)(.+) ([0-9a-fA-F]{8})\r{0,2}(?:\n|\Z)', re.M)
 
     @staticmethod
     def make_std_filename(filename):
@@ -1391,6 +1694,7 @@ class SFVMD5(SFV_Base, MD5_MixIn):
     # auto_filename_match = 'md5$' #hm. People are probably used to .md5 making a md5sum format file, so we can't just do this.
 
     _sfvrem = re.compile(r'(.+) ([0-9a-fA-F]{32})[\r\n]*$')
+    _bulkrem = re.compile(r'^(?!;)(.+) ([0-9a-fA-F]{32})\r{0,2}(?:\n|\Z)', re.M)
 
     @staticmethod
     def make_std_filename(filename):
@@ -1552,6 +1856,7 @@ class JPEGSheriff_CRC(TextChksumType, CRC_MixIn):
     name = 'crc'
     description = 'JPEGSheriff'
     descinfo = 'name,size,dimensions,CRC32'
+    updatable = False  # the dimensions aren't kept, and the header has to be read before the lines
 
     @staticmethod
     def auto_chksumfile_match(file, _autorem=re.compile(r'^Filename\s+(Filesize\s+)?.*?CRC-?32.*^-+(\s+-+){1,4}\s*$', re.DOTALL | re.IGNORECASE | re.MULTILINE)):
@@ -1693,6 +1998,18 @@ def visit_dir(name, st=None, noisy=1):
     return 0
 
 
+def visit_entry(name, entry, noisy=1):
+    """Like visit_dir, for a DirEntry from scandir.
+
+    Its type usually needs no stat, so only dirs are stat'ed, for the check for already visited dirs.
+    """
+    if not entry.is_dir():
+        return 0
+    if not config.dereference:
+        return not entry.is_symlink()
+    return visit_dir(name, entry.stat(), noisy)
+
+
 def test(filename, typename, restrict_typename='auto'):
     if typename != 'auto':
         cf = cftypes.get_handler(typename)()
@@ -1716,58 +2033,180 @@ def test(filename, typename, restrict_typename='auto'):
     stats.cferror += 1
 
 
-def make(cftype, ifilename, testfiles):
-    file = None
-    if ifilename:
-        filename = ifilename
-    else:
-        filename = cftype.make_std_filename(os.path.basename(curdir))
-        if config.gzip == 1 and filename[-3:] != '.gz':  # if user does -zz, perhaps they want to force the filename to be kept?
-            filename += '.gz'
-    if not hasattr(cftype, 'make_addfile'):
-        view.ev_make_cf_typenotsupported(filename, cftype)
+def read_update_entries(cftype, filename):
+    """Return an ordered map of filename -> (filecrc, filesize) of the entries in the checksum file filename, to update it."""
+    cf = cftype()
+    entries = OrderedDict()
+
+    def add_entry(filename, filecrc, filesize, prefixmd5):
+        entries[filename] = (filecrc, filesize)
+
+    def line_error(evfunc, *args):
+        # unlike when only planning, lines that can't be read are reported, since make won't update the checksum file then.
         stats.cferror += 1
+        evfunc(*args)
+    cf.collect = add_entry
+    cf.line_error = line_error
+    file = fileutil.open_read(filename, config)
+    try:
+        cf.do_test_chksumlines(file)
+    finally:
+        file.close()
+    return entries
+
+
+def use_update_entry(t, filename, filecrc, filesize):
+    """Put the digest of filename from the checksum file being updated into the cache, unless the file has changed."""
+    try:
+        st = os.stat(filename)
+    except EnvironmentError:
         return
-    if os.path.exists(filename):
-        view.ev_make_cf_alreadyexists(filename)
-        stats.cferror += 1
-        file = IOError  # just need some special value to indicate a cferror so that recursive mode still continues to work, IOError seems like a good choice ;)
-    if not testfiles:
-        tfauto = True
-        testfiles = osutil.listdir(osutil.curdiru)
-        if config.dirsort:
-            strutil.safesort(testfiles)
-    else:
-        tfauto = False
-    testdirs = []
+    # a file that doesn't have the size the checksum file says has surely changed, so it is always read again.
+    if (filesize >= 0 and st.st_size != filesize) or (config.update == 2 and st.st_mtime_ns > t.mtime_ns):
+        return
+    cinfo = cache.getcinfo(filename, st)
+    if 'size' not in cinfo:
+        for name in getattr(t.cftype, 'hashers', ()):
+            cinfo[name] = filecrc
+        cinfo['size'] = st.st_size
+        t.reused = True
 
-    cf_stats = stats.make_sub_stats()
 
-    i = 0
-    while i < len(testfiles):
-        f = testfiles[i]
-        i += 1
-        if not tfauto and f == '-':
-            f = ''
-        elif not os.path.isfile(f):
-            if config.recursive and visit_dir(f):
+def update_leftovers(updating):
+    """Yield the files in the checksum files being updated that weren't among the files given or found, unless they are gone."""
+    for filename in OrderedDict((n, 1) for t in updating for n in t.entries):
+        if os.path.isfile(filename):
+            yield filename
+
+
+def scandir_sorted(path):
+    """Return a list of (path, DirEntry) of the entries in dir path, sorted by name if dirsort is on."""
+    entries = list(osutil.scandir(path or osutil.curdiru))
+    if config.dirsort:
+        entries.sort(key=lambda e: e.name)
+    return [(path and osutil.path_join(path, e.name) or e.name, e) for e in entries]
+
+
+def make_walk(testfiles, testdirs):
+    """Yield the files to make checksums of, from testfiles or else the current dir.
+
+    Dirs are added to testdirs with -r, and walked depth first with -rr, listing each dir only when it is reached.
+    The types of the entries found by listing dirs are taken from their DirEntry, which usually needs no stat.
+    """
+    tfauto = not testfiles
+    if tfauto:
+        stack = [iter(scandir_sorted(''))]
+    else:
+        stack = [iter((f, None) for f in testfiles)]
+    while stack:
+        for f, entry in stack[-1]:
+            if entry is None:
+                if f == '-':
+                    yield ''
+                    continue
+                if os.path.isfile(f):
+                    yield f
+                    continue
+                isdir = config.recursive and visit_dir(f)
+            else:
+                if entry.is_file():
+                    yield f
+                    continue
+                try:
+                    isdir = config.recursive and visit_entry(f, entry)
+                except OSError:
+                    isdir = False
+            if isdir:
                 if config.recursive == 1:
                     testdirs.append(f)
                 elif config.recursive == 2:
                     try:
-                        rfiles = osutil.listdir(f)
-                        if config.dirsort:
-                            strutil.safesort(rfiles)
-                        testfiles[:i] = list(map(lambda x, p=f: osutil.path_join(p, x), rfiles))
-                        i = 0
+                        stack.append(iter(scandir_sorted(f)))
                     except EnvironmentError as a:
                         view.ev_d_enverror(f, a)
                         stats.ferror += 1
-                continue
-            if tfauto:  # if user isn't specifying files, don't even try to add dirs and stuff, and don't print errors about it.
-                continue
+                    else:
+                        break
+            elif not tfauto:  # if user isn't specifying files, don't even try to add dirs and stuff, and don't print errors about it.
+                yield f
+        else:
+            stack.pop()
+
+
+def make(cftypelist, ifilename, testfiles):
+    # all the checksum files are made together, so that each file only needs to be read once.
+    targets = []
+    for cftype in cftypelist:
+        file = None
+        entries = tmpname = mtime_ns = None
+        starttime_ns = time.time_ns()
+        if ifilename:
+            filename = ifilename
+        else:
+            filename = cftype.make_std_filename(os.path.basename(curdir))
+            if config.gzip == 1 and not fileutil.compressed_ext(filename):  # if user does -zz, perhaps they want to force the filename to be kept?
+                filename += '.gz'
+        if not hasattr(cftype, 'make_addfile'):
+            view.ev_make_cf_typenotsupported(filename, cftype)
+            stats.cferror += 1
+            continue
+        if filename in [t.filename for t in targets] or (os.path.exists(filename) and not (config.update and cftype.updatable)):
+            view.ev_make_cf_alreadyexists(filename)
+            stats.cferror += 1
+            file = IOError  # just need some special value to indicate a cferror so that recursive mode still continues to work, IOError seems like a good choice ;)
+        elif os.path.exists(filename):
+            # the new checksum file is written beside the old one and renamed over it once done, keeping the extension for the compression.
+            fpath, ftail = os.path.split(filename)
+            tmpname = osutil.path_join(fpath, '.cfv%i-%s' % (os.getpid(), ftail))
+            try:
+                mtime_ns = os.stat(filename).st_mtime_ns
+                cferror = stats.cferror
+                entries = read_update_entries(cftype, filename)
+            except EnvironmentError as a:
+                stats.cferror += 1
+                view.ev_cf_enverror(filename, a)
+                file = IOError
+            else:
+                if stats.cferror != cferror:  # the lines that couldn't be read were already counted as errors
+                    view.ev_cf_enverror(filename, EnvironmentError(errno.EINVAL, 'not updating, since some lines could not be read'))
+                    file = IOError
+                    entries = None
+        targets.append(Data(cftype=cftype, filename=filename, file=file, cf=None, stats=None, entries=entries, tmpname=tmpname, mtime_ns=mtime_ns, starttime_ns=starttime_ns, reused=False))
+    if not targets:
+        return
+    if len(targets) > 1:
+        for t in targets:
+            want_hashes(getattr(t.cftype, 'hashers', {}))
+        # types that read the file data themselves go first, their read then fills in the digests the others need.
+        targets.sort(key=lambda t: bool(getattr(t.cftype, 'hashers', None)))
+    updating = [t for t in targets if t.entries is not None]
+    skipnames = set(os.path.abspath(n) for t in updating for n in (t.filename, t.tmpname))
+    for t in updating:
+        # the checksum file is rewritten even if none of its files are left.
+        try:
+            t.cf = t.cftype()
+            t.file = t.cf.make_chksumfile_create(t.tmpname)
+        except EnvironmentError as a:
+            stats.cferror += 1
+            view.ev_cf_enverror(t.filename, a)
+            t.file = IOError
+    testdirs = []
+
+    for t in targets:
+        t.stats = stats.make_sub_stats()
+
+    files = make_walk(testfiles, testdirs)
+    if updating:
+        files = itertools.chain(files, update_leftovers(updating))
+    for f in files:
+        if skipnames and os.path.abspath(f) in skipnames:
+            continue
+        for t in updating:
+            entry = t.entries.pop(os.path.normpath(f), None)
+            if entry is not None:
+                use_update_entry(t, f, *entry)
         stats.num += 1
-        if file is IOError:
+        if not [t for t in targets if t.file is not IOError]:
             continue
         if config.encoding != 'raw':
             # Try decode with errors=strict (surrogates disabled)
@@ -1784,50 +2223,80 @@ def make(cftype, ifilename, testfiles):
                 stats.ferror += 1
                 view.ev_make_filenameencodingerror(f, e)
                 continue
-        if not cftype.filename_ok(f):
-            stats.ferror += 1
-            view.ev_make_filenameinvalid(f)
-            continue
-        if file is None:
+        ok = None
+        for t in targets:
+            if t.file is IOError:
+                continue
+            if not t.cftype.filename_ok(f):
+                stats.ferror += 1
+                view.ev_make_filenameinvalid(f)
+                ok = False
+                continue
+            if t.file is None:
+                try:
+                    t.cf = t.cftype()
+                    t.file = t.cf.make_chksumfile_create(t.filename)
+                except EnvironmentError as a:
+                    stats.cferror += 1
+                    view.ev_cf_enverror(t.filename, a)
+                    t.file = IOError
+                    ok = False
+                    continue
+            try:
+                (filecrc, filesize), dat = t.cf.make_addfile(f)
+            except EnvironmentError as a:
+                if a.errno == errno.ENOENT:
+                    stats.notfound += 1
+                else:
+                    stats.ferror += 1
+                view.ev_f_enverror(f, a)
+                ok = False
+                break  # an error reading the file itself would just repeat for every type
             try:
-                cf = cftype()
-                file = cf.make_chksumfile_create(filename)
+                t.cf.make_writefile(dat, t.file)
             except EnvironmentError as a:
                 stats.cferror += 1
-                view.ev_cf_enverror(filename, a)
-                file = IOError
+                view.ev_cf_enverror(t.filename, a)
+                t.file = IOError
+                ok = False
                 continue
-        try:
-            (filecrc, filesize), dat = cf.make_addfile(f)
-        except EnvironmentError as a:
-            if a.errno == errno.ENOENT:
-                stats.notfound += 1
-            else:
+            except UnicodeError as e:
                 stats.ferror += 1
-            view.ev_f_enverror(f, a)
-            continue
-        try:
-            cf.make_writefile(dat, file)
-        except EnvironmentError as a:
-            stats.cferror += 1
-            view.ev_cf_enverror(filename, a)
-            file = IOError
-            continue
-        except UnicodeError as e:
-            stats.ferror += 1
-            view.ev_make_filenameencodingerror(f, e)
-            continue
-        view.ev_f_ok(f, filesize, filecrc, 'OK')
-        stats.ok += 1
-    if file and file is not IOError:
-        try:
-            cf.make_chksumfile_finish(file)
-        except EnvironmentError as a:
-            stats.cferror += 1
-            view.ev_cf_enverror(filename, a)
-        else:
-            cf_stats.sub_stats_end(stats)
-            view.ev_make_cf_done(filename, cf_stats)
+                view.ev_make_filenameencodingerror(f, e)
+                ok = False
+                continue
+            if ok is None:
+                ok = (filecrc, filesize)
+        if ok:
+            filecrc, filesize = ok
+            view.ev_f_ok(f, filesize, filecrc, 'OK')
+            stats.ok += 1
+    for t in targets:
+        if t.file and t.file is not IOError:
+            try:
+                t.cf.make_chksumfile_finish(t.file)
+                if t.tmpname:
+                    shutil.copymode(t.filename, t.tmpname)
+                    if config.update == 2:
+                        # the entries carried over were checked to be older than the old checksum file, and files changed after the start of the run could have been missed.
+                        mtime_ns = t.starttime_ns
+                    elif t.reused:
+                        # the entries carried over weren't checked, so they are still only as recent as the old checksum file, for a later --update-changed.
+                        mtime_ns = t.mtime_ns
+                    else:
+                        mtime_ns = None
+                    if mtime_ns is not None:
+                        os.utime(t.tmpname, ns=(os.stat(t.tmpname).st_atime_ns, mtime_ns))
+                    os.replace(t.tmpname, t.filename)
+            except EnvironmentError as a:
+                stats.cferror += 1
+                view.ev_cf_enverror(t.filename, a)
+            else:
+                t.stats.sub_stats_end(stats)
+                view.ev_make_cf_done(t.filename, t.stats)
+                continue
+        if t.tmpname and os.path.exists(t.tmpname):
+            os.unlink(t.tmpname)
 
     for f in testdirs:
         try:
@@ -1836,7 +2305,7 @@ def make(cftype, ifilename, testfiles):
             view.ev_d_enverror(f, a)
             stats.ferror += 1
         else:
-            make(cftype, ifilename, None)
+            make(cftypelist, ifilename, None)
             cdup()
 
 
@@ -1850,34 +2319,31 @@ def unverified_file(filename):
     stats.unverified += 1
 
 
-def show_unverified_dir(path, unvchild=0):
-    pathcache = cache.getpathcache(path)
-    pathfiles = osutil.listdir(path or osutil.curdiru)
+def show_unverified_dir(path, unvchild=0, st=None):
+    pathcache = cache.getpathcache(path, st)
+    entries = list(osutil.scandir(path or osutil.curdiru))
     vsub = 0
     unvsave = stats.unverified
     unv = 0
     unv_sub_dirs = []
-    for fn in pathfiles:
-        filename = osutil.path_join(path, fn)
+    for entry in entries:
+        filename = osutil.path_join(path, entry.name)
         try:
-            st = os.stat(filename)
-            if S_ISDIR(st.st_mode) and visit_dir(filename, st, noisy=0):
+            if visit_entry(filename, entry, noisy=0):
                 dunvsave = stats.unverified
-                dv = show_unverified_dir(filename, not pathcache)
+                dv = show_unverified_dir(filename, not pathcache, entry.stat())
                 vsub += dv
                 if stats.unverified - dunvsave and not dv:  # if this directory (and its subdirs) had unverified files and no verified files
                     unv_sub_dirs.append(filename)
             elif pathcache:
-                if not (pathcache.get(fn, {}).get('_verified') or pathcache.get(fn, {}).get('_verified')):
-                    if S_ISREG(st.st_mode):
-                        show_unverified_file(filename)
-            else:
-                if S_ISREG(st.st_mode):
-                    unverified_file(filename)
-                    unv += 1
+                if not pathcache.get(entry.name, {}).get('_verified') and entry.is_file():
+                    show_unverified_file(filename)
+            elif entry.is_file():
+                unverified_file(filename)
+                unv += 1
         except OSError:
             pass
-    if not pathcache and pathfiles:
+    if not pathcache and entries:
         if vsub:  # if sub directories do have verified files
             if unv:  # and this directory does have unverified files
                 view.ev_unverified_dir(path)
@@ -1889,18 +2355,15 @@ def show_unverified_dir(path, unvchild=0):
     return vsub + (not not pathcache)
 
 
-def show_unverified_dir_verbose(path):
-    pathcache = cache.getpathcache(path)
-    pathfiles = osutil.listdir(path or osutil.curdiru)
-    for fn in pathfiles:
-        filename = osutil.path_join(path, fn)
+def show_unverified_dir_verbose(path, st=None):
+    pathcache = cache.getpathcache(path, st)
+    for entry in list(osutil.scandir(path or osutil.curdiru)):
+        filename = osutil.path_join(path, entry.name)
         try:
-            st = os.stat(filename)
-            if S_ISDIR(st.st_mode) and visit_dir(filename, st, noisy=0):
-                show_unverified_dir_verbose(filename)
-            elif not (pathcache.get(fn, {}).get('_verified') or pathcache.get(fn, {}).get('_verified')):
-                if S_ISREG(st.st_mode):
-                    show_unverified_file(filename)
+            if visit_entry(filename, entry, noisy=0):
+                show_unverified_dir_verbose(filename, entry.stat())
+            elif not pathcache.get(entry.name, {}).get('_verified') and entry.is_file():
+                show_unverified_file(filename)
         except OSError:
             pass
 
@@ -1931,13 +2394,49 @@ def show_unverified_files(filelist):
 # md5sum/sha1sum files have no standard extension, so just search for
 # files with md5/sha1 in the name anywhere, and let the test func see
 # if it really is one.
-atrem = re.compile(r'md5|sha1|sha224|sha256|sha384|sha512|\.(csv|sfv|par|p[0-9][0-9]|par2|torrent|crc)(\.gz)?$', re.IGNORECASE)
+atrem = re.compile(r'md5|sha1|sha224|sha256|sha384|sha512|\.(csv|sfv|par|p[0-9][0-9]|par2|torrent|crc)(\.(gz|bz2|xz|zst))?$', re.IGNORECASE)
+
+
+def plan_tests(filenames, restrict_typename='auto'):
+    """Parse the text checksum files among filenames before testing any of them, noting the hashes that each file they list will need.
+
+    A file listed in several checksum files is then read only once, calculating the hashes for all of them.
+    """
+    for filename in filenames:
+        try:
+            file = fileutil.open_read(filename, config)
+        except EnvironmentError:
+            continue  # reported when testing
+        try:
+            cftype = cftypes.auto_chksumfile_match(file)
+            # like when updating, only the types whose entries can be read without the setup done when testing starts.
+            if not cftype or not issubclass(cftype, TextChksumType) or not cftype.updatable:
+                continue
+            if restrict_typename != 'auto' and cftypes.get_handler(restrict_typename) != cftype:
+                continue
+            cf = cftype()
+
+            def plan_file(filename, filecrc, filesize, prefixmd5):
+                if filecrc:
+                    try:
+                        cache.want(filename, cf.hashers)
+                    except EnvironmentError:
+                        pass  # reported when testing
+            cf.collect = plan_file
+            cf.do_test_chksumlines(file)
+        except Exception:
+            pass  # planning is only an optimization, whatever went wrong is reported when the file is tested.
+        finally:
+            file.close()
 
 
 def autotest(typename):
     files = osutil.listdir(osutil.curdiru)
     if config.dirsort:
         strutil.safesort(files)
+    cfs = [a for a in files if atrem.search(a)]
+    if len(cfs) > 1 and config.docrcchecks:
+        plan_tests(cfs, typename)
     for a in files:
         if config.recursive and visit_dir(a):
             try:
@@ -1964,7 +2463,9 @@ def printusage(err=0):
     phelp('  -T       test mode (default)')
     phelp('  -C       create mode')
     phelp('  -t <t>   set type to <t> (%s, or auto(default))' % ', '.join(sorted(cftypes.get_handler_names())))
+    phelp('           may be given multiple times in create mode, to make each type from one read of the files')
     phelp('  -f <f>   use <f> as list file')
+    phelp('  -j <n>   read and hash up to <n> files at once when testing (default 1)')
     phelp('  -m       check only for missing files (don\'t compare checksums)')
     phelp('  -M       check checksums (default)')
     phelp('  -n       rename bad files')
@@ -1985,7 +2486,7 @@ def printusage(err=0):
     phelp('  -zz      force making gzipped files, even if not ending in .gz')
     phelp('  -z       make gzipped files in auto create mode')
     phelp('  -Z       don\'t create gzipped files automatically. (default)')
-    phelp('  -ZZ      never use gzip, even if file ends in .gz')
+    phelp('  -ZZ      never use compression, even if file ends in .gz/.bz2/.xz/.zst')
     phelp(' --list=<l> raw list files of type <l> (%s)' % ', '.join(ui.LISTARGS))
     phelp(' --list0=<l> same as list, but seperate files with nulls (useful for xargs -0)')
     phelp(' --encoding=<e>  encoding of checksum files (raw, auto(default), or...)')
@@ -1995,6 +2496,19 @@ def printusage(err=0):
     phelp(' --showpaths=<p> show full paths (none/auto/yes-absolute/relative)')
     phelp(' --renameformat=<f> format string to use with -n option')
     phelp(' --progress=VAL  show progress meter (yes, no, or auto(default))')
+    phelp(' --pool=VAL  use a pool of threads(default) or processes for -j')
+    phelp(' --blocksize=N  read files N bytes at a time when not using mmap (default %i)' % hash.DEFAULT_BLOCKSIZE)
+    phelp(' --io=VAL  read files through mmap(default), buffered, or direct (O_DIRECT)')
+    phelp(' --hashcache=VAL  keep digests in a persistent cache: off(default), update, or trust')
+    phelp(' --trust-cache  same as --hashcache=trust')
+    phelp(' --no-cache  same as --hashcache=off')
+    phelp(' --hashcache_file=<f>  file to keep the hash cache in')
+    phelp(' --hashcache_size=N  forget the least recently used files above N')
+    phelp(' --xattr-cache=VAL  keep digests in extended attributes of files: off(default), read, or write')
+    phelp(' --search=VAL  search for misnamed files: no(default), dir (same as -s), or tree (anywhere under the start dir)')
+    phelp(' --update  in create mode, update existing checksum files, only reading new files (entries of changed files are kept unverified, unless the checksum file has sizes and the size changed)')
+    phelp(' --update-changed  same as --update, also reading files modified since the checksum file')
+    phelp(' --archival=VAL  avoid updating access times and filling the page cache (yes or no(default))')
     phelp(' --help/-h show help')
     phelp(' --version show cfv and module versions')
     phelp('torrent creation options:')
@@ -2024,23 +2538,53 @@ def printcftypehelp(err):
 
 
 stats = Stats()
+wanted_hashes = {}
 config = Config()
 cache = caching.FileInfoCache()
+hashstore = None
 view = ui.View(config)
 filenamefilter = FileNameFilter()
 
 
+def create(manual, typenames, args):
+    """Create checksum files of the given typenames for args, or for each manually specified filename."""
+    if not manual:
+        handlers = []
+        for typename in typenames or ['auto']:
+            if typename == 'auto':
+                typename = config.default_type_name
+            if cftypes.get_handler(typename) not in handlers:
+                handlers.append(cftypes.get_handler(typename))
+        make(handlers, None, args)
+    for a in manual:
+        if typenames and typenames[0] != 'auto':
+            make([cftypes.get_handler(typenames[0])], a, args)
+        else:
+            testa = ''
+            ext = fileutil.compressed_ext(a)
+            if config.gzip >= 0 and ext:
+                testa = a[:-len(ext)]
+            cftype = cftypes.auto_filename_match(a, testa)
+            if not cftype:
+                raise CFVValueError('specify a filetype with -t, or use standard extension')
+            make([cftype], a, args)
+
+
 def main(argv=None):
+    global searchroot
     if argv is None:
         argv = sys.argv[1:]
     manual = []
     mode = 0
     typename = 'auto'
+    typenames = []
 
     try:
-        optlist, args = getopt.getopt(argv, 'rRlLTCt:f:mMnNsSp:uUiIvVzZqQh?',
+        optlist, args = getopt.getopt(argv, 'rRlLTCt:f:j:mMnNsSp:uUiIvVzZqQh?',
                                       ['list=', 'list0=', 'fixpaths=', 'strippaths=', 'showpaths=', 'renameformat=', 'progress=', 'unquote=', 'help', 'version',
                                        'encoding=',
+                                       'pool=', 'blocksize=', 'io=', 'archival=',
+                                       'hashcache=', 'hashcache_file=', 'hashcache_size=', 'trust-cache', 'no-cache', 'xattr-cache=', 'search=', 'update', 'update-changed',
                                        'announceurl=', 'piece_size_pow2=', 'private_torrent', 'noprivate_torrent',  # torrent options
                                        ])
     except getopt.error as a:
@@ -2077,8 +2621,24 @@ def main(argv=None):
                     view.perror('cfv: type %s not recognized' % a)
                     printcftypehelp(err=1)
                 typename = a
+                if a not in typenames:
+                    typenames.append(a)
             elif o == '-f':
                 manual.append(a)  # filename selected manually, don't try to autodetect
+            elif o == '-j':
+                config.setx('jobs', a)
+            elif o in ('--pool', '--blocksize', '--io', '--archival', '--hashcache', '--hashcache_file', '--hashcache_size'):
+                config.setx(o[2:], a)
+            elif o == '--trust-cache':
+                config.hashcache = 'trust'
+            elif o == '--no-cache':
+                config.hashcache = 'off'
+            elif o == '--xattr-cache':
+                config.setx('xattr_cache', a)
+            elif o == '--search':
+                config.setx('search', a)
+            elif o in ('--update', '--update-changed'):
+                config.update = o == '--update-changed' and 2 or 1
             elif o == '-U':
                 config.showunverified = 0
             elif o == '-u':
@@ -2178,39 +2738,30 @@ def main(argv=None):
                 print('python %08x-%s' % (sys.hexversion, sys.platform))
                 sys.exit(0)
             prevopt = o
+        if mode == 1 and len(typenames) > 1 and manual:
+            raise CFVValueError('only a single type can be given with -f in create mode')
     except CFVValueError as e:
         view.perror('cfv: %s' % e)
         sys.exit(1)
 
     view.setup_output()
 
-    if not manual:
+    searchroot = curdir
+    openhashstore()
+    try:
         if mode == 0:
             filenamefilter.set_testfiles(args)
-            autotest(typename)
-        else:
-            if typename == 'auto':
-                typename = config.default_type_name
-            make(cftypes.get_handler(typename), None, args)
-    else:
-        for a in manual:
-            if mode == 0:
-                filenamefilter.set_testfiles(args)
+            if not manual:
+                autotest(typename)
+            for a in manual:
                 test(a, typename)
-            else:
-                if typename != 'auto':
-                    make(cftypes.get_handler(typename), a, args)
-                else:
-                    testa = ''
-                    if config.gzip >= 0 and a[-3:] == '.gz':
-                        testa = a[:-3]
-                    cftype = cftypes.auto_filename_match(a, testa)
-                    if not cftype:
-                        raise CFVValueError('specify a filetype with -t, or use standard extension')
-                    make(cftype, a, args)
-
-    if mode == 0:
-        show_unverified_files(args)
+        else:
+            create(manual, typenames, args)
+
+        if mode == 0:
+            show_unverified_files(args)
+    finally:
+        closehashstore()
 
     # only print total stats if more than one checksum file has been checked. (or if none have)
     # We must also print stats here if there are unverified files or checksum file errors, since those conditions occur outside of the cf_stats section.
@@ -1,8 +1,11 @@
 from builtins import object
 
 import codecs
+import errno
+import re
 import sys
-from io import BytesIO, TextIOWrapper
+import zlib
+from io import BufferedIOBase, TextIOWrapper, UnsupportedOperation
 
 from cfv import osutil
 
@@ -16,10 +19,30 @@ def _markbadbytes(exc):
 
 codecs.register_error('markbadbytes', _markbadbytes)
 
+# line breaks other than \n, \r\n, and the \r\r\n of corrupted files.
+_oddbreaks = re.compile('\r(?!\r?\n)|[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+# line breaks as split by an io.TextIOWrapper with newline=''
+_iobreak = re.compile('\r\n|\r|\n')
+# line breaks as split by str.splitlines
+_linebreak = re.compile('\r\n|[\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+# encodings decoded with an io.TextIOWrapper, which is much faster than a codecs StreamReader.
+_io_encodings = ('utf-8', 'iso8859-1', 'ascii', 'utf-16', 'utf-16-le', 'utf-16-be', 'utf-32', 'utf-32-le', 'utf-32-be')
+
+
+def plainlines(text):
+    """Split text from a plain block (see PeekFile.isplainblock) into lines."""
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
 
 class PeekFile(object):
     def __init__(self, fileobj, filename=None, encoding='auto'):
-        self.fileobj = fileobj
+        self.fileobj = self._rawfile = fileobj
         self._init_decodeobj(encoding)
         self.name = filename or fileobj.name
 
@@ -40,16 +63,39 @@ class PeekFile(object):
         if self._encoding is None:
             self._encoding = osutil.getencoding(encoding)
         self._encodeerrors = osutil.getencodeerrors(encoding, default='markbadbytes')
+        self._textio = codecs.lookup(self._encoding).name in _io_encodings
+        self.decodeobj = None
         self._reset_decodeobj()
 
     def _reset_decodeobj(self):
+        self._drop_decodeobj()
         self.fileobj.seek(self._decode_start)
-        if self._encoding is not None:
+        if self._textio:
+            # newline='' splits lines without translating them, so that the crcrlf workaround still sees the \r\r\n.
+            self.decodeobj = TextIOWrapper(self.fileobj, self._encoding, self._encodeerrors, newline='')
+        elif self._encoding is not None:
             self.decodeobj = codecs.getreader(self._encoding)(self.fileobj, errors=self._encodeerrors)
         self._prevlineend = None
+        self._pendinglines = []
+        self._blockrest = ''
+
+    def _drop_decodeobj(self):
+        # a TextIOWrapper would close fileobj when it goes away.
+        if self._textio and self.decodeobj is not None:
+            self.decodeobj.detach()
+        self.decodeobj = None
 
     def _readline(self, *args):
-        line = self.decodeobj.readline(*args)
+        if self._pendinglines:
+            line = self._pendinglines.pop()
+        else:
+            line = self.decodeobj.readline(*args)
+            if self._textio:
+                # a TextIOWrapper only breaks lines at \r and \n, split the rest of the lines the way a codecs StreamReader does.
+                lines = line.splitlines(True)
+                if len(lines) > 1:
+                    line = lines[0]
+                    self._pendinglines = lines[:0:-1]
         # work around corrupted files that have crcrlf line endings.  (With StreamReaders in python versions >= 2.4, you no longer get it all as one line.)
         if self._prevlineend == '\r' and line == '\r\n':
             self._prevlineend = None
@@ -61,6 +107,41 @@ class PeekFile(object):
                 raise UnicodeError('%r codec: %i decode errors' % (self._encoding, badbytecount))
         return line
 
+    def _readblock(self, size=2 ** 20):
+        chunks = [self._blockrest]
+        while 1:
+            data = self.decodeobj.read(size)
+            if not data:
+                self._blockrest = ''
+                return ''.join(chunks)
+            end = data.rfind('\n') + 1
+            if end:
+                chunks.append(data[:end])
+                self._blockrest = data[end:]
+                return ''.join(chunks)
+            chunks.append(data)
+
+    def isplainblock(self, block):
+        """Return true if block can be split into lines at its \\n characters, giving the same lines as readline."""
+        if self._encodeerrors == 'markbadbytes' and _badbytesmarker in block:
+            return False
+        return not _oddbreaks.search(block)
+
+    def blocklines(self, block):
+        """Yield the lines of block as readline would return them, or UnicodeErrors for lines with undecodable bytes."""
+        prevlineend = None
+        for line in block.splitlines(True):
+            if prevlineend == '\r' and line == '\r\n':
+                prevlineend = None
+                continue
+            prevlineend = line[-1:]
+            if self._encodeerrors == 'markbadbytes':
+                badbytecount = line.count(_badbytesmarker)
+                if badbytecount:
+                    yield UnicodeError('%r codec: %i decode errors' % (self._encoding, badbytecount))
+                    continue
+            yield line
+
     def peek(self, *args):
         self.fileobj.seek(0)
         return self.fileobj.read(*args)
@@ -89,8 +170,11 @@ class PeekFile(object):
             return ''
 
     def _done_peeking(self, raw):
+        if isinstance(self.fileobj, PeekStream):
+            self.fileobj.done_peeking()
         if raw:
             fileobj = self.fileobj
+            self._drop_decodeobj()
             fileobj.seek(0)
             del self.decodeobj
         else:
@@ -102,6 +186,7 @@ class PeekFile(object):
         self.peekline = None
         self.peek = None
         self.readline = self._readline
+        self.readblock = self._readblock
         self.read = fileobj.read
         self.seek = fileobj.seek
 
@@ -113,22 +198,275 @@ class PeekFile(object):
         self._done_peeking(raw=0)
         return self._readline(*args)
 
+    def readblock(self, *args):
+        """Read whole lines of decoded text, about size characters of them, or '' at EOF."""
+        self._done_peeking(raw=0)
+        return self._readblock(*args)
+
     def read(self, *args):
         self._done_peeking(raw=1)
         return self.read(*args)
 
+    def close(self):
+        # the decodeobj only wraps fileobj, so closing fileobj is enough.
+        self._rawfile.close()
+
+
+class PeekHead(object):
+    """The start of a PeekFile, read and decoded once, with the peek methods of PeekFile.
+
+    Checksum file types are tried against this instead of the file itself, which would reread and decode the file for each type.
+    Anything that does not fit in the head is peeked from the file.
+    """
+
+    def __init__(self, file, size=2 ** 14):
+        self.file = file
+        self.name = file.name
+        self._raw = file.peek(size)
+        self._complete = len(self._raw) < size
+        try:
+            decoder = codecs.getincrementaldecoder(file._encoding)(file._encodeerrors)
+            self._text = decoder.decode(self._raw[file._decode_start:], self._complete)
+        except UnicodeError:
+            self._text = None  # let the file report strict decoding errors at the line they are in.
+        self._linebreak = file._textio and _iobreak or _linebreak
+        self._fallback = self._text is None
+        self._pendinglines = []
+
+    def peek(self, *args):
+        if args and args[0] >= 0 and (self._complete or args[0] <= len(self._raw)):
+            return self._raw[:args[0]]
+        if not args and self._complete:
+            return self._raw
+        return self.file.peek(*args)
+
+    def peekdecoded(self, size=-1):
+        # a codecs StreamReader reads size bytes rather than size characters.
+        if self._text is not None and self.file._textio and 0 <= size and (self._complete or size <= len(self._text)):
+            return self._text[:size]
+        return self.file.peekdecoded(size)
+
+    def peekline(self, *args):
+        self._pos = 0
+        self._rest = ''
+        self._pendinglines = []
+        self._prevlineend = None
+        self._calls = 0
+        self._fallback = self._text is None
+        return self.peeknextline(*args)
+
+    def peeknextline(self, *args):
+        self._calls += 1
+        if not self._fallback:
+            try:
+                line = self._readline(*args)
+            except UnicodeError:
+                self.file._decode_errs = 1
+                return ''
+            if line is not None:
+                return line
+            # the line runs past the head, replay the lines so far on the file itself.
+            self._fallback = True
+            if self._calls == 1:
+                return self.file.peekline(*args)
+            self.file.peekline(*args)
+            for i in range(self._calls - 2):
+                self.file.peeknextline(*args)
+        return self.file.peeknextline(*args)
+
+    def _nextline(self):
+        if self._rest:
+            line, self._rest = self._rest, ''
+            return line
+        text, pos = self._text, self._pos
+        x = self._linebreak.search(text, pos)
+        end = x.end() if x else len(text)
+        # the last line of an incomplete head may continue past it.
+        if end == len(text) and not self._complete:
+            return None
+        self._pos = end
+        return text[pos:end]
+
+    def _readline(self, size=-1):
+        """Return the line PeekFile._readline would, or None if it is not all in the head."""
+        if self._pendinglines:
+            line = self._pendinglines.pop()
+        else:
+            line = self._nextline()
+            if line is None:
+                return None
+            if self.file._textio:
+                # unlike a codecs StreamReader, a TextIOWrapper limits the length of the lines it returns, before they are split at the other line breaks.
+                if size is not None and 0 <= size < len(line):
+                    line, self._rest = line[:size], line[size:]
+                lines = line.splitlines(True)
+                if len(lines) > 1:
+                    line = lines[0]
+                    self._pendinglines = lines[:0:-1]
+        if self._prevlineend == '\r' and line == '\r\n':
+            self._prevlineend = None
+            return self._readline(size)
+        self._prevlineend = line[-1:]
+        if self.file._encodeerrors == 'markbadbytes':
+            badbytecount = line.count(_badbytesmarker)
+            if badbytecount:
+                raise UnicodeError('%r codec: %i decode errors' % (self.file._encoding, badbytecount))
+        return line
+
+
+class PeekStream(BufferedIOBase):
+    """Make a nonseekable stream seekable within the part of it read while peeking.
+
+    Once done peeking, the rest of the stream is read through without keeping it, so only the head is ever held in memory.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._head = b''
+        self._headstart = 0
+        self._pos = 0
+        self._peeking = True
+
+    def done_peeking(self):
+        self._peeking = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence != 0:
+            raise UnsupportedOperation('can only seek relative to the start of a stream')
+        if pos < self._headstart:
+            raise UnsupportedOperation('can not seek back past the head of a stream')
+        headend = self._headstart + len(self._head)
+        if pos > headend:
+            self._pos = headend
+            while self._pos < pos and self.read(min(pos - self._pos, 2 ** 16)):
+                pass
+        else:
+            self._pos = pos
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        offset = self._pos - self._headstart
+        data = self._head[offset:offset + size] if size >= 0 else self._head[offset:]
+        while size < 0 or len(data) < size:
+            more = self.fileobj.read(size - len(data) if size >= 0 else -1)
+            if not more:
+                break
+            if self._peeking:
+                self._head += more
+            elif self._head:
+                self._headstart += len(self._head)
+                self._head = b''
+            data += more
+        self._pos += len(data)
+        return data
+
+    read1 = read
+
 
 def PeekFileNonseekable(fileobj, filename, encoding):
-    return PeekFile(BytesIO(fileobj.read()), filename, encoding)
+    return PeekFile(PeekStream(fileobj), filename, encoding)
+
+
+# compressed checksum file formats, as (extension, magic, module).  The module's open function is used to read and write them.
+_compressions = (
+    ('.gz', re.compile(b'\x1f\x8b'), 'gzip'),
+    ('.bz2', re.compile(b'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'), 'bz2'),
+    ('.xz', re.compile(b'\xfd7zXZ\x00'), 'lzma'),
+    ('.zst', re.compile(re.escape(b'\x28\xb5\x2f\xfd')), 'zstandard'),
+)
+
+
+def compressed_ext(filename):
+    """Return the compression extension filename ends with, or ''."""
+    lfilename = filename.lower()
+    for ext, magic, module in _compressions:
+        if lfilename.endswith(ext):
+            return ext
+    return ''
+
+
+def _getcompression(filename, magic, config):
+    if config.gzip < 0:
+        return None
+    if magic is not None:
+        for ext, magicre, module in _compressions:
+            if magicre.match(magic):
+                return module
+    ext = compressed_ext(filename)
+    for cext, magicre, module in _compressions:
+        if ext == cext:
+            return module
+    if config.gzip >= 2:
+        return 'gzip'
+    return None
+
+
+def _opencompressed(module, fileobj, mode):
+    try:
+        compression = __import__(module)
+    except ImportError:
+        raise EnvironmentError('the %s module is needed for %s compressed files' % (module, module))
+    if 'r' not in mode:
+        return compression.open(fileobj, mode)
+    # besides the OSErrors of bz2 and gzip, corrupt or truncated data can raise these.
+    errors = (EOFError, zlib.error) + tuple(getattr(compression, name) for name in ('LZMAError', 'ZstdError') if hasattr(compression, name))
+    return DecompressedFile(_call(errors, compression.open, fileobj, mode), errors)
+
+
+def _call(errors, func, *args):
+    try:
+        return func(*args)
+    except errors as e:
+        raise EnvironmentError(errno.EINVAL, str(e))
+
+
+class DecompressedFile(BufferedIOBase):
+    """Read a decompressing file object, raising its decompression errors as EnvironmentErrors, like reading any other bad file."""
+
+    def __init__(self, fileobj, errors):
+        self.fileobj = fileobj
+        self._errors = errors
 
+    @property
+    def closed(self):
+        return self.fileobj.closed
 
-def PeekFileGzip(filename, encoding):
-    import gzip
-    if filename == '-':
-        f = gzip.GzipFile(mode='rb', fileobj=sys.stdin.buffer)
-    else:
-        f = gzip.open(filename, 'rb')
-    return PeekFile(f, filename, encoding)
+    def close(self):
+        self.fileobj.close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.fileobj.seekable()
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def seek(self, *args):
+        return _call(self._errors, self.fileobj.seek, *args)
+
+    def read(self, size=-1):
+        return _call(self._errors, self.fileobj.read, size)
+
+    def read1(self, size=-1):
+        return _call(self._errors, getattr(self.fileobj, 'read1', self.fileobj.read), size)
+
+    def readinto(self, b):
+        return _call(self._errors, self.fileobj.readinto, b)
 
 
 class NoCloseFile(object):
@@ -147,25 +485,29 @@ def open_read(filename, config):
     # binary.  The text routines should cope with all types of line
     # endings anyway, so this doesn't hurt us.)
     mode = 'rb'
-    if config.gzip >= 2 or (config.gzip >= 0 and filename[-3:].lower() == '.gz'):
-        return PeekFileGzip(filename, config.encoding)
+    if filename == '-':
+        fileobj = PeekStream(sys.stdin.buffer)
     else:
-        if filename == '-':
-            return PeekFileNonseekable(sys.stdin.buffer, filename, config.encoding)
-        return PeekFile(open(filename, mode), filename, config.encoding)
+        fileobj = open(filename, mode)
+    module = _getcompression(filename, fileobj.read(10), config)
+    fileobj.seek(0)
+    if module is None:
+        return PeekFile(fileobj, filename, config.encoding)
+    if filename == '-':
+        fileobj.done_peeking()
+    else:
+        fileobj.close()
+        fileobj = filename
+    f = _opencompressed(module, fileobj, mode)
+    if filename == '-' or not f.seekable():
+        return PeekFileNonseekable(f, filename, config.encoding)
+    return PeekFile(f, filename, config.encoding)
 
 
 def open_write(filename, config, force_raw=False):
-    if config.gzip >= 2 or (config.gzip >= 0 and filename[-3:].lower() == '.gz'):
-        import gzip
-        kwargs = {
-            'filename': filename,
-            'mode': 'wb',
-        }
-        if filename == '-':
-            kwargs['fileobj'] = sys.stdout.buffer
-
-        binary_file = gzip.GzipFile(**kwargs)
+    module = _getcompression(filename, None, config)
+    if module is not None:
+        binary_file = _opencompressed(module, filename == '-' and NoCloseFile(sys.stdout.buffer) or filename, 'wb')
     else:
         if filename == '-':
             binary_file = NoCloseFile(sys.stdout.buffer)
@@ -1,79 +1,260 @@
 from builtins import object
 
+import errno
 import hashlib
 import os
 import struct
 import sys
+import threading
+from stat import S_ISREG
 from zlib import crc32
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 try:
     if os.environ.get('CFV_NOMMAP'):
         raise ImportError
     import mmap
 
-    def dommap(fileno, len):  # generic mmap.  ACCESS_* args work on both nix and win.
-        if len == 0:
-            return b''  # mmap doesn't like length=0
-        return mmap.mmap(fileno, len, access=mmap.ACCESS_READ)
-
     _nommap = 0
 except ImportError:
     _nommap = 1
-
-_MAX_MMAP = 2 ** 32 - 1
-_FALLBACK_MMAP = 2 ** 31 - 1
+else:
+    # windows must start at a multiple of the allocation granularity; keep them small enough for 32 bit address spaces.
+    _MMAP_WINDOW = max(2 ** 28 // mmap.ALLOCATIONGRANULARITY, 1) * mmap.ALLOCATIONGRANULARITY
+    _MMAP_SLICE = 2 ** 20
 
 
 md5 = hashlib.md5
 sha1 = hashlib.sha1
 
 
-def _getfilechecksum(filename, hasher, callback):
-    if filename == '':
-        f = sys.stdin.buffer
-    else:
-        f = open(filename, 'rb')
-
-    def finish(m, s):
-        while 1:
-            x = f.read(65536)
-            if not x:
-                return m.digest(), s
-            s += len(x)
-            m.update(x)
+DEFAULT_BLOCKSIZE = 2 ** 16
+DIRECT_BLOCKSIZE = 2 ** 20
+_DROP_INTERVAL = 2 ** 23
+
+IO_MODES = ('mmap', 'buffered', 'direct')
+_O_DIRECT = getattr(os, 'O_DIRECT', 0)
+
+_buffers = threading.local()
+
+
+def _getbuffer(size):
+    # each thread reuses one buffer, so that reading doesn't allocate a new bytes object for every block.
+    buf = getattr(_buffers, 'buf', None)
+    if buf is None or len(buf) != size:
+        buf = _buffers.buf = memoryview(bytearray(size))
+    return buf
+
+
+def _getalignedbuffer(size):
+    # O_DIRECT needs the buffer, offset and length aligned to the block size of the device; anonymous maps start on a page boundary.
+    size = -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+    buf = getattr(_buffers, 'aligned', None)
+    if buf is None or len(buf) != size:
+        buf = _buffers.aligned = memoryview(mmap.mmap(-1, size))
+    return buf
+
+
+def _isdirect(f):
+    return fcntl.fcntl(f.fileno(), fcntl.F_GETFL) & _O_DIRECT
+
+
+def _feedall(hashers, data):
+    for m in hashers:
+        m.update(data)
+
+
+def _fadvise(f, offset, length, advice):
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), offset, length, getattr(os, advice))
+        except EnvironmentError:
+            pass  # not all files support it (pipes, some filesystems)
+
+
+def _feedmmap(f, size, hashers, callback, reader):
+    offset = 0
+    while offset < size:
+        length = min(_MMAP_WINDOW, size - offset)
+        # ACCESS_* args work on both nix and win.
+        data = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=offset)
+        try:
+            if hasattr(data, 'madvise'):
+                data.madvise(mmap.MADV_SEQUENTIAL)
             if callback:
-                callback(s)
+                # hash slices of the mapping, so that progress can be shown without copying the data.
+                with memoryview(data) as view:
+                    for i in range(0, length, _MMAP_SLICE):
+                        _feedall(hashers, view[i:i + _MMAP_SLICE])
+                        callback(offset + min(i + _MMAP_SLICE, length))
+            else:
+                _feedall(hashers, data)
+        finally:
+            data.close()
+        reader.drop(f, offset, length)
+        offset += length
+    return size
+
+
+class Reader(object):
+    """How files are read for hashing.
+
+    A Reader only holds options, so it can be shared between threads and
+    passed to worker processes.
+
+    In archival mode, files are read without updating their access time
+    where permitted, and without leaving the data that has been hashed in
+    the page cache.
+
+    io is one of IO_MODES: regular files are hashed through mmap, read
+    into a buffer, or read with O_DIRECT, bypassing the page cache.  Where
+    a mode isn't available, the next one that is gets used.
+    """
 
-    if f == sys.stdin.buffer or _nommap or callback:
-        return finish(hasher(), 0)
-    else:
-        s = os.path.getsize(filename)
+    def __init__(self, blocksize=DEFAULT_BLOCKSIZE, archival=False, io='mmap'):
+        self.blocksize = blocksize
+        self.archival = archival
+        self.io = io
+
+    def _osopen(self, filename, flags):
+        flags |= os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+        if self.archival and hasattr(os, 'O_NOATIME'):
+            try:
+                return os.open(filename, flags | os.O_NOATIME)
+            except EnvironmentError as e:
+                if e.errno != errno.EPERM:  # only the owner of a file may use O_NOATIME
+                    raise
+        return os.open(filename, flags)
+
+    def open(self, filename):
+        if not self.archival:
+            return open(filename, 'rb')
+        f = open(self._osopen(filename, 0), 'rb')
+        _fadvise(f, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        return f
+
+    def opendirect(self, filename):
+        """Open filename for unbuffered reading with O_DIRECT, or return None if io isn't direct or the filesystem doesn't support it."""
+        if self.io != 'direct' or not _O_DIRECT or fcntl is None or _nommap:
+            return None
         try:
-            if s > _MAX_MMAP:
-                # Work around python 2.[56] problem with md5 of large mmap objects
-                raise OverflowError
-            m = hasher(dommap(f.fileno(), s))
-        except OverflowError:
-            # mmap size is limited by C's int type, which even on 64 bit
-            # arches is often 32 bits, so we can't use sys.maxint
-            # either.  If we get the error, just assume 32 bits.
-            mmapsize = min(s, _FALLBACK_MMAP)
-            m = hasher(dommap(f.fileno(), mmapsize))
-            f.seek(mmapsize)
-            # unfortunatly, python's mmap module doesn't support the
-            # offset parameter, so we just have to do the rest of the
-            # file the old fashioned way.
-            return finish(m, mmapsize)
-        return m.digest(), s
+            fd = self._osopen(filename, _O_DIRECT)
+        except EnvironmentError as e:
+            if e.errno != errno.EINVAL:  # eg. tmpfs
+                raise
+            return None
+        return open(fd, 'rb', buffering=0)
 
+    def drop(self, f, offset, length):
+        """Tell the kernel that the given range of f has been hashed and isn't needed in the page cache anymore."""
+        if self.archival:
+            _fadvise(f, offset, length, 'POSIX_FADV_DONTNEED')
 
-def getfilechecksumgeneric(algo):
+    def feed(self, f, hashers, callback, s=0, size=None):
+        """Feed hashers from f until EOF or size bytes, return s plus the number of bytes read."""
+        if self.io == 'direct' and fcntl is not None and _isdirect(f):
+            return self._feeddirect(f, hashers, callback, s, size)
+        pos = f.tell() if self.archival and f.seekable() else None
+        dropped = pos
+        buf = _getbuffer(self.blocksize)
+        left = size
+        while left is None or left > 0:
+            if left is not None and left < len(buf):
+                n = f.readinto(buf[:left])
+            else:
+                n = f.readinto(buf)
+            if not n:
+                break
+            _feedall(hashers, buf[:n])
+            s += n
+            if left is not None:
+                left -= n
+            if callback:
+                callback(s)
+            if pos is not None:
+                pos += n
+                if pos - dropped >= _DROP_INTERVAL:
+                    self.drop(f, dropped, pos - dropped)
+                    dropped = pos
+        if pos is not None and pos > dropped:
+            self.drop(f, dropped, pos - dropped)
+        return s
+
+    def _feeddirect(self, f, hashers, callback, s, size):
+        buf = _getalignedbuffer(max(self.blocksize, DIRECT_BLOCKSIZE))
+        left = size
+        while left is None or left > 0:
+            # always read whole aligned blocks; at the end of the file the read just comes up short.
+            try:
+                n = f.readinto(buf)
+            except EnvironmentError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                # an unaligned offset (after a short read, or a seek), or a filesystem that won't read the tail directly.
+                fd = f.fileno()
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~_O_DIRECT)
+                return self.feed(f, hashers, callback, s, left)
+            if not n:
+                break
+            if left is not None:
+                n = min(n, left)
+                left -= n
+            _feedall(hashers, buf[:n])
+            s += n
+            if callback:
+                callback(s)
+        return s
+
+    def feedfile(self, filename, hashers, callback, size=None):
+        """Feed every object in hashers from a single read of filename, or its first size bytes, return the number of bytes read."""
+        if filename == '':
+            return self.feed(sys.stdin.buffer, hashers, callback, size=size)
+        with self.opendirect(filename) or self.open(filename) as f:
+            st = os.fstat(f.fileno())
+            if _nommap or self.io != 'mmap' or not S_ISREG(st.st_mode) or size is not None:
+                return self.feed(f, hashers, callback, size=size)
+            # map the file a window at a time, so that files of any size can be hashed without copying the data.
+            return _feedmmap(f, st.st_size, hashers, callback, self)
+
+
+_default_reader = Reader()
+
+
+def _getfilechecksum(filename, hasher, callback):
+    m = hasher()
+    s = _default_reader.feedfile(filename, [m], callback)
+    return m.digest(), s
+
+
+def getfilechecksums(filename, hashers, callback, sinks=(), reader=None):
+    """Calculate several checksums of filename while reading it only once.
+
+    hashers is a mapping of name -> hasher.  sinks are additional objects
+    with an update method that get fed the same data.  Returns a mapping of
+    name -> digest, and the file size.
+    """
+    ms = dict((name, hasher()) for name, hasher in hashers.items())
+    s = (reader or _default_reader).feedfile(filename, list(ms.values()) + list(sinks), callback)
+    return dict((name, m.digest()) for name, m in ms.items()), s
+
+
+def gethasher(algo):
+    if algo == 'crc':
+        return CRC32
     if hasattr(hashlib, algo):
-        hasher = getattr(hashlib, algo)
-    else:
-        def hasher():
-            return hashlib.new(algo)
+        return getattr(hashlib, algo)
+
+    def hasher(s=b''):
+        return hashlib.new(algo, s)
+    return hasher
+
+
+def getfilechecksumgeneric(algo):
+    hasher = gethasher(algo)
     return lambda filename, callback: _getfilechecksum(filename, hasher, callback), hasher().digest_size
 
 
@@ -92,3 +273,83 @@ class CRC32(object):
 
 def getfilecrc(filename, callback):
     return _getfilechecksum(filename, CRC32, callback)
+
+
+def _gf2_times(mat, vec):
+    s = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            s ^= mat[i]
+        vec >>= 1
+        i += 1
+    return s
+
+
+def _gf2_square(mat):
+    return [_gf2_times(mat, m) for m in mat]
+
+
+class CRC32Shift(object):
+    """The change to a crc32 value from appending length zero bytes to the data.
+
+    Building the operator is the expensive part, applying it is cheap, so an
+    instance can be reused for combining many ranges of the same length.
+    """
+
+    def __init__(self, length):
+        op = [0xedb88320] + [1 << n for n in range(31)]  # one zero bit
+        for _ in range(3):
+            op = _gf2_square(op)  # one zero byte
+        self.mat = [1 << n for n in range(32)]
+        while length:
+            if length & 1:
+                self.mat = [_gf2_times(op, m) for m in self.mat]
+            length >>= 1
+            if length:
+                op = _gf2_square(op)
+
+    def __call__(self, crc):
+        return _gf2_times(self.mat, crc)
+
+
+def crc32_combine(crc1, crc2, len2):
+    """Return the crc32 of A+B, given crc32(A), crc32(B) and the length of B.
+
+    >>> crc32_combine(crc32(b'foo'), crc32(b'bar'), 3) == crc32(b'foobar')
+    True
+    """
+    return CRC32Shift(len2)(crc1) ^ crc2
+
+
+class PieceHasher(object):
+    """Collect the sha1 digests of consecutive fixed size pieces of the data fed to it.
+
+    Data fed in one update call may span piece boundaries, so this can share
+    a read with the whole file hashers.
+    """
+
+    def __init__(self, piece_length):
+        self.piece_length = piece_length
+        self.pieces = []
+        self.sh = sha1()
+        self.piece_done = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while len(data):
+            piece_left = self.piece_length - self.piece_done
+            self.sh.update(data[:piece_left])
+            self.piece_done += min(piece_left, len(data))
+            data = data[piece_left:]
+            if self.piece_done == self.piece_length:
+                self.pieces.append(self.sh.digest())
+                self.sh = sha1()
+                self.piece_done = 0
+
+    def finish(self):
+        if self.piece_done > 0:
+            self.pieces.append(self.sh.digest())
+            self.sh = sha1()
+            self.piece_done = 0
+        return self.pieces
@@ -54,6 +54,7 @@ except (TypeError, ValueError):
 getcwdu = os.getcwd
 curdiru = os.curdir
 listdir = os.listdir
+scandir = os.scandir
 
 
 def path_join(*paths):
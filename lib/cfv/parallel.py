@@ -0,0 +1,186 @@
+#    cfv - Command-line File Verify
+#    Copyright (C) 2000-2013  Matthew Mueller <donut AT dakotacom DOT net>
+#    Copyright (C) 2018-2022  David Gnedt <cfv-project AT davizone DOT at>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from builtins import object
+
+import collections
+import os
+import struct
+
+from cfv import hash
+
+
+BACKENDS = ('thread', 'process')
+
+# files at least this big get their crc32 calculated in ranges by getfilecrc
+CRC_RANGES_MIN = 2 ** 26
+
+_executors = {}
+
+
+def get_executor(jobs, backend='thread', purpose='files'):
+    """Return a shared pool of jobs worker threads or processes.
+
+    Work that waits for other work in the pool would deadlock once all the
+    workers are waiting, so such work gets a separate pool by purpose.
+    """
+    key = (backend, jobs, purpose)
+    executor = _executors.get(key)
+    if executor is None:
+        if backend == 'process':
+            from concurrent.futures import ProcessPoolExecutor as Executor
+        else:
+            from concurrent.futures import ThreadPoolExecutor as Executor
+        executor = _executors[key] = Executor(max_workers=jobs)
+    return executor
+
+
+def statkey(st):
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def hashfile(filename, names, filesize=-1, jobs=1, reader=None):
+    """Read filename once, calculating the named hashes.
+
+    Returns (digests, size, statkey), or None if the file can't be read or
+    doesn't have the expected size.  Errors are left for the main thread to
+    find and report when it tests the file itself.
+    """
+    try:
+        st = os.stat(filename)
+        if filesize >= 0 and st.st_size != filesize:
+            return None
+        if jobs > 1 and names == ['crc'] and st.st_size >= CRC_RANGES_MIN:
+            digests = {}
+            digests['crc'], size = getfilecrc(filename, jobs, None, reader)
+        else:
+            digests, size = hash.getfilechecksums(filename, dict((name, hash.gethasher(name)) for name in names), None, reader=reader)
+    except (EnvironmentError, UnicodeError):
+        return None
+    return digests, size, statkey(st)
+
+
+def crc32_range(filename, offset, size, progress, index, reader):
+    def callback(done):
+        progress[index] = done
+    m = hash.CRC32()
+    with reader.opendirect(filename) or reader.open(filename) as f:
+        f.seek(offset)
+        done = reader.feed(f, [m], callback, size=size)
+    return m.value, done
+
+
+def getfilecrc(filename, jobs, callback, reader=None, rangesize=None, _align=2 ** 20):
+    """Calculate the crc32 of filename, reading ranges of it in jobs threads.
+
+    The crcs of the ranges are merged with crc32_combine, giving the same
+    result as hash.getfilecrc.
+    """
+    size = os.path.getsize(filename)
+    if rangesize is None:
+        rangesize = -(-size // (jobs * 4) // _align) * _align or _align
+    offsets = list(range(0, size, rangesize)) or [0]
+    progress = [0] * len(offsets)
+    executor = get_executor(jobs, purpose='crc32_range')
+    reader = reader or hash.Reader()
+    futures = [executor.submit(crc32_range, filename, offset, min(rangesize, size - offset), progress, i, reader) for i, offset in enumerate(offsets)]
+    if callback:
+        import concurrent.futures
+        while concurrent.futures.wait(futures, timeout=0.1)[1]:
+            callback(sum(progress))
+    results = [future.result() for future in futures]
+    if [done for crc, done in results] != [min(rangesize, size - offset) for offset in offsets]:
+        # the file changed size while reading, just do it the normal way.
+        return hash.getfilecrc(filename, callback)
+    shift = hash.CRC32Shift(rangesize)
+    crc = results[0][0]
+    for rcrc, done in results[1:-1]:
+        crc = shift(crc) ^ rcrc
+    if len(results) > 1:
+        rcrc, done = results[-1]
+        crc = hash.crc32_combine(crc, rcrc, done)
+    return struct.pack('>I', crc & 0xFFFFFFFF), size
+
+
+def runbatch(func, argslist):
+    return [func(*args) for args in argslist]
+
+
+class _Batch(object):
+    def __init__(self):
+        self.argslist = []
+        self.future = None
+
+
+class Pipeline(object):
+    """Run callbacks in the order they were added, each one after the pool
+    work it depends on has finished.
+
+    Work is sent to the pool in batches of batchsize calls, which keeps the
+    overhead of talking to worker processes down.  At most window callbacks
+    are held back, which bounds both the memory used and how far the workers
+    can get ahead of the reporting.
+    """
+
+    def __init__(self, executor, func, window, batchsize=1):
+        self.executor = executor
+        self.func = func
+        self.window = window
+        self.batchsize = batchsize
+        self.batch = None
+        self.pending = collections.deque()
+
+    def add(self, callback, *args):
+        """Queue callback(result), where result is func(*args) if any args are given, else None."""
+        batch = index = None
+        if args:
+            if self.batch is None:
+                self.batch = _Batch()
+            batch = self.batch
+            index = len(batch.argslist)
+            batch.argslist.append(args)
+            if len(batch.argslist) >= self.batchsize:
+                self.submit()
+        self.pending.append((callback, batch, index))
+        while len(self.pending) > self.window:
+            self.runone()
+
+    def submit(self):
+        if self.batch is not None:
+            self.batch.future = self.executor.submit(runbatch, self.func, self.batch.argslist)
+            self.batch = None
+
+    def runone(self):
+        callback, batch, index = self.pending.popleft()
+        if batch is None:
+            callback(None)
+            return
+        if batch.future is None:
+            self.submit()
+        callback(batch.future.result()[index])
+
+    def flush(self):
+        while self.pending:
+            self.runone()
+
+    def cancel(self):
+        self.batch = None
+        while self.pending:
+            callback, batch, index = self.pending.popleft()
+            if batch is not None and batch.future is not None:
+                batch.future.cancel()
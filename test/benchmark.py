@@ -24,6 +24,7 @@ import argparse
 import math
 import os
 import random
+import subprocess
 import sys
 import tempfile
 import timeit
@@ -156,6 +157,40 @@ def run(args):
         print_times('multitest', times, args.iterations, args.verbose)
 
 
+def run_importtime(libdir):
+    """Return the cumulative import times in usec of each module imported by cfv.common."""
+    env = dict(os.environ, PYTHONPATH=libdir)
+    # measure importing from the bytecode cache, as an installed cfv would.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import cfv.common'], env=env, stderr=subprocess.PIPE, universal_newlines=True)
+    err = proc.communicate()[1]
+    if proc.returncode:
+        raise RuntimeError('importing cfv.common failed: ' + err)
+    times = {}
+    for line in err.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def importtime(args):
+    cfvtest.setcfv(args.cfv, True)
+    import cfv
+    libdir = os.path.dirname(os.path.dirname(os.path.abspath(cfv.__file__)))
+    # the first run may need to write the bytecode cache.
+    run_importtime(libdir)
+    results = [run_importtime(libdir) for i in range(args.repeats)]
+    best = min(results, key=lambda r: r['cfv.common'])
+    print('import cfv.common: best=%.4g msec' % (best['cfv.common'] / 1000))
+    if args.verbose:
+        for name in sorted(best, key=best.get, reverse=True)[:args.verbose * 10]:
+            print('  %8.3f msec %s' % (best[name] / 1000, name))
+    if args.budget and best['cfv.common'] > args.budget * 1000:
+        print('over budget of %.4g msec' % args.budget)
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Create test data and run cfv benchmarks.')
 
@@ -181,6 +216,12 @@ def main():
     run_parser.add_argument('--repeats', default=3, type=int, help='number of repeats')
     run_parser.add_argument('--type', default='sha1', help='checksum type')
     run_parser.set_defaults(func=run)
+
+    importtime_parser = subparsers.add_parser('importtime', help='measure the time to import cfv, with python -X importtime')
+    importtime_parser.add_argument('--cfv', help='path to the cfv executable')
+    importtime_parser.add_argument('--repeats', default=10, type=int, help='number of repeats')
+    importtime_parser.add_argument('--budget', default=30, type=float, help='fail if importing cfv.common takes longer than this many msec (0 for no limit)')
+    importtime_parser.set_defaults(func=importtime)
     # TODO: add args to allow specifying additional flags for running cfv
     # TODO: run cfv with defaults (not using .cfvrc)
     # TODO: allow running the different benchmarks (create/test/multitest) independantly, and allow testing against a specified checksum file
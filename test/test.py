@@ -30,6 +30,7 @@ from builtins import object
 
 import getopt
 import gzip
+import hashlib
 import locale
 import operator
 import os
@@ -1534,6 +1535,369 @@ def private_torrent_test():
         shutil.rmtree(tmpd)
 
 
+def multitype_C_test():
+    d = tempfile.mkdtemp()
+    try:
+        for fn in ('data1', 'data2', 'data3'):
+            shutil.copyfile(fn, os.path.join(d, fn))
+        test_generic(cfvcmd + ' -C -p %s -t sfv -t sha1 -t csv -t torrent' % d, rcurry(cfv_all_test, files=3, ok=3))
+        cfs = sorted(os.listdir(d))
+        test_log_results('multitype create', '', repr(cfs), len(cfs) != 7, {})
+        for cf in cfs:
+            if not cf.startswith('data'):
+                test_generic(cfvcmd + ' -T -p %s -f %s' % (d, cf), rcurry(cfv_all_test, ok=3))
+        test_generic(cfvcmd + ' -C -p %s -t sfv -t sha1 -f foo' % d, rcurry(status_test, 1), stdout='/dev/null')
+    finally:
+        shutil.rmtree(d)
+
+
+def jobs_test(extra='-j 3'):
+    """Check that parallel testing gives the same results in the same order as serial testing."""
+    def strip_times(o):
+        return re.sub(r'[\d.]+ seconds, [\d.]+K(/s)?', '', o)
+
+    def compare(name, cmd, setup=None, check=None):
+        outs = []
+        for jobs in ('', extra):
+            d = tempfile.mkdtemp()
+            try:
+                for fn in ('data1', 'data2', 'data3', 'data4'):
+                    shutil.copyfile(fn, os.path.join(d, fn))
+                if setup:
+                    setup(d)
+                outs.append(cfvtest.runcfv(cfvcmd + ' %s -p %s %s' % (jobs, d, cmd)))
+            finally:
+                shutil.rmtree(d)
+        (s1, o1), (s2, o2) = outs
+        test_log_results('%s %s' % (extra, name), (s1, s2), o1 + '\n' + o2, s1 != s2 or strip_times(o1) != strip_times(o2), None)
+        if check:
+            # the same results could still both be wrong.
+            test_log_results('%s %s results' % (extra, name), s2, o2, check(s2, o2), None)
+
+    def mixed_sha1(d):
+        with open(os.path.join(d, 'mixed.sha1'), 'w') as f:
+            f.write('%s  data1\n' % hashlib.sha1(readfile('data1')).hexdigest())  # textmode
+            f.write('garbage\n')
+            f.write('%s *data2\n' % hashlib.sha1(b'foo').hexdigest())
+            f.write('%s *missing\n' % hashlib.sha1(b'foo').hexdigest())
+            f.write('%s *data3\n' % hashlib.sha1(readfile('data3')).hexdigest())
+            f.write('%s *data1\n' % hashlib.sha1(readfile('data1')).hexdigest())
+            f.write('%s *data4\n' % hashlib.sha1(readfile('data4')).hexdigest())
+
+    def copy_testfiles(d):
+        for fn in ('test.sfv', 'testfix.csv', 'test.csv4', 'test.crc', 'test.bsdmd5', 'testcrcrlf.sha256', 'testquoted.sfv'):
+            shutil.copyfile(fn, os.path.join(d, fn))
+
+    compare('mixed', '-v -T -f mixed.sha1', mixed_sha1)
+    compare('mixed rename', '-v -n -T -f mixed.sha1', mixed_sha1)
+    compare('mixed search', '-v -s -T -f mixed.sha1', mixed_sha1)
+    compare('testfiles', '-v --unquote=yes -T', copy_testfiles, rcurry(cfv_all_test, ok=20, notfound=5))
+    compare('testfiles -u', '-u -T', copy_testfiles, rcurry(cfv_all_test, ok=18, notfound=7, unv=1))
+
+
+def hashcache_test():
+    d = tempfile.mkdtemp()
+    try:
+        db = os.path.join(d, 'cache', 'hashes.sqlite')
+        data = os.path.join(d, 'data')
+        writefile(data, b'foo' * 100)
+        old = time.time() - 60
+        os.utime(data, (old, old))
+        writefile(os.path.join(d, 'test.md5'), ('%s *data\n' % hashlib.md5(b'foo' * 100).hexdigest()).encode('ascii'))
+        cmd = cfvcmd + ' --hashcache_file=%s -p %s -T -f test.md5' % (db, d)
+        test_generic(cmd + ' --trust-cache', rcurry(cfv_all_test, ok=1))
+        test_generic(cmd + ' --hashcache=update', rcurry(cfv_all_test, ok=1))
+        # change the data but not the size or mtime: a trusted cache can't tell.
+        writefile(data, b'bar' * 100)
+        os.utime(data, (old, old))
+        test_generic(cmd + ' --trust-cache', rcurry(cfv_all_test, ok=1))
+        test_generic(cmd + ' --trust-cache --no-cache', rcurry(cfv_all_test, badcrc=1))
+        test_generic(cmd + ' --hashcache=update', rcurry(cfv_all_test, badcrc=1))
+        test_generic(cmd + ' --trust-cache -j 2', rcurry(cfv_all_test, badcrc=1))
+        os.utime(data, (old + 1, old + 1))
+        test_generic(cmd + ' --trust-cache', rcurry(cfv_all_test, badcrc=1))
+        # recently modified files aren't stored.
+        writefile(data, b'foo' * 100)
+        test_generic(cmd + ' --trust-cache', rcurry(cfv_all_test, ok=1))
+        writefile(data, b'bar' * 100)
+        test_generic(cmd + ' --trust-cache', rcurry(cfv_all_test, badcrc=1))
+    finally:
+        shutil.rmtree(d)
+
+
+def xattr_cache_test():
+    d = tempfile.mkdtemp()
+    try:
+        data = os.path.join(d, 'data')
+        writefile(data, b'foo' * 100)
+        try:
+            os.setxattr(data, 'user.cfv.test', b'')
+            os.removexattr(data, 'user.cfv.test')
+        except (AttributeError, EnvironmentError):
+            return  # extended attributes not supported here
+        old = time.time() - 60
+        os.utime(data, (old, old))
+        writefile(os.path.join(d, 'test.md5'), ('%s *data\n' % hashlib.md5(b'foo' * 100).hexdigest()).encode('ascii'))
+        cmd = cfvcmd + ' -p %s -T -f test.md5' % d
+        test_generic(cmd + ' --xattr-cache=read', rcurry(cfv_all_test, ok=1))
+        test_generic(cmd + ' --xattr-cache=write', rcurry(cfv_all_test, ok=1))
+        # change the data but not the size or mtime: the stored digest is still used.
+        writefile(data, b'bar' * 100)
+        os.utime(data, (old, old))
+        test_generic(cmd + ' --xattr-cache=read', rcurry(cfv_all_test, ok=1))
+        test_generic(cmd + ' --xattr-cache=off', rcurry(cfv_all_test, badcrc=1))
+        test_generic(cmd + ' --xattr-cache=read -j 2 --pool=process', rcurry(cfv_all_test, ok=1))
+        # a stale stamp falls back to reading the file, and write replaces it.
+        os.utime(data, (old + 1, old + 1))
+        test_generic(cmd + ' --xattr-cache=write', rcurry(cfv_all_test, badcrc=1))
+        test_generic(cmd + ' --xattr-cache=read', rcurry(cfv_all_test, badcrc=1))
+        os.utime(data, (old, old))
+        test_generic(cmd + ' --xattr-cache=read', rcurry(cfv_all_test, badcrc=1))
+    finally:
+        shutil.rmtree(d)
+
+
+def hardlink_test():
+    d = tempfile.mkdtemp()
+    try:
+        data = os.path.join(d, 'data')
+        writefile(data, b'foo' * 100000)
+        try:
+            os.link(data, os.path.join(d, 'link'))
+        except (AttributeError, OSError):
+            return
+        writefile(os.path.join(d, 'other'), b'bar' * 100000)
+        digest = hashlib.md5(b'foo' * 100000).hexdigest()
+        writefile(os.path.join(d, 'test.md5'), ('%s *data\n%s *link\n%s *other\n' % (digest, digest, digest)).encode('ascii'))
+        test_generic(cfvcmd + ' -p %s -T -f test.md5' % d, rcurry(cfv_all_test, ok=2, badcrc=1))
+        test_generic(cfvcmd + ' -j 2 -p %s -T -f test.md5' % d, rcurry(cfv_all_test, ok=2, badcrc=1))
+        test_generic(cfvcmd + ' -p %s -n -T -f test.md5' % d, rcurry(cfv_all_test, ok=2, badcrc=1))
+        test_generic(cfvcmd + ' -p %s -T -f test.md5' % d, rcurry(cfv_all_test, ok=2, notfound=1))
+    finally:
+        shutil.rmtree(d)
+
+
+def multimanifest_test():
+    """Check the results when several checksum files in a directory, planned together, list the same files."""
+    d = tempfile.mkdtemp()
+    try:
+        files = [('a', b'a' * 3000), ('b', b'b' * 3000), ('c', b'c')]
+        md5 = sha256 = sfv = ''
+        for fn, data in files:
+            writefile(os.path.join(d, fn), data)
+            md5 += '%s *%s\n' % (hashlib.md5(data).hexdigest(), fn)
+            sha256 += '%s *%s\n' % (hashlib.sha256(fn == 'b' and b'x' or data).hexdigest(), fn)
+            if fn != 'c':
+                sfv += '%s %08X\n' % (fn, zlib.crc32(data) & 0xffffffff)
+        writefile(os.path.join(d, 'foo.md5'), md5.encode('ascii'))
+        writefile(os.path.join(d, 'foo.sha256'), sha256.encode('ascii'))
+        writefile(os.path.join(d, 'foo.sfv'), (sfv + 'garbage\n').encode('ascii'))
+        test_generic(cfvcmd + ' -p %s -T' % d, rcurry(cfv_all_test, ok=7, badcrc=1, cferror=1))
+        test_generic(cfvcmd + ' -j 2 -p %s -T' % d, rcurry(cfv_all_test, ok=7, badcrc=1, cferror=1))
+        test_generic(cfvcmd + ' -t sha256 -p %s -T' % d, rcurry(cfv_all_test, ok=2, badcrc=1))
+        test_generic(cfvcmd + ' -m -p %s -T' % d, rcurry(cfv_all_test, ok=8, cferror=1))
+        test_generic(cfvcmd + ' -p %s -n -T' % d, rcurry(cfv_all_test, ok=7, badcrc=1, cferror=1))
+        test_generic(cfvcmd + ' -p %s -T' % d, rcurry(cfv_all_test, ok=5, notfound=3, cferror=1))
+    finally:
+        shutil.rmtree(d)
+
+
+def bulkparse_test():
+    """Check the line numbers of bad lines in a checksum file bigger than the blocks it is parsed in."""
+    d = tempfile.mkdtemp()
+    try:
+        bad = (6, 12346, 23000, 30000)
+        lines = []
+        for i in range(1, 30001):
+            if i in bad:
+                lines.append(b'garbage\n')
+            elif i == 20000:
+                lines.append(b'\xff\n')
+            elif i == 2:
+                lines.append(b'# comment\n')
+            else:
+                lines.append(('%s *data%i%s\n' % (hashlib.sha1(b'').hexdigest(), i, i % 7 and '\r' or '')).encode('ascii'))
+        writefile(os.path.join(d, 'test.sha1'), b''.join(lines))
+
+        def lines_test(s, o):
+            found = [int(x) for x in re.findall(r'unrecognized line (\d+)', o)]
+            encerrs = [int(x) for x in re.findall(r'line (\d+): .*decode', o)]
+            return int(found != list(bad) or encerrs != [20000] or cfv_all_test(s, o, notfound=30000 - 6, cferror=5))
+        test_generic(cfvcmd + ' -m -p %s -T -f test.sha1' % d, lines_test)
+    finally:
+        shutil.rmtree(d)
+
+
+def search_many_test():
+    """Check searching for many misnamed files of the same size, with and without renaming them back."""
+    d = tempfile.mkdtemp()
+    try:
+        lines = []
+        for i in range(50):
+            data = ('data%02i' % i).encode('ascii')
+            writefile(os.path.join(d, 'renamed%02i' % ((i * 7) % 50)), data)
+            lines.append('%s *orig%02i\n' % (hashlib.md5(data).hexdigest(), i))
+        writefile(os.path.join(d, 'test.md5'), ''.join(lines).encode('ascii'))
+        test_generic(cfvcmd + ' -p %s -s -T -f test.md5' % d, rcurry(cfv_all_test, ok=50, misnamed=50))
+        test_generic(cfvcmd + ' -p %s -s -n -T -f test.md5' % d, rcurry(cfv_all_test, ok=50, misnamed=50))
+        test_generic(cfvcmd + ' -p %s -T -f test.md5' % d, rcurry(cfv_all_test, ok=50))
+        r = readfile(os.path.join(d, 'orig07')) != b'data07'
+        test_log_results('search_many renamed contents', r, '', r, None)
+    finally:
+        shutil.rmtree(d)
+
+
+def search_tree_test():
+    """Check searching for files that were moved to other dirs, from checksum files in several dirs."""
+    d = tempfile.mkdtemp()
+    try:
+        for fn in ('a/one', 'a/two', 'b/three'):
+            os.makedirs(os.path.join(d, os.path.dirname(fn)), exist_ok=True)
+            writefile(os.path.join(d, fn), fn.encode('ascii'))
+        test_generic(cfvcmd + ' -p %s -C -rr -t md5 -f all.md5' % d, cfv_test)
+        test_generic(cfvcmd + ' -p %s -C -t sfv' % os.path.join(d, 'a'), cfv_test)
+        os.makedirs(os.path.join(d, 'c'))
+        os.rename(os.path.join(d, 'a', 'one'), os.path.join(d, 'c', 'uno'))
+        os.rename(os.path.join(d, 'a', 'two'), os.path.join(d, 'b', 'two'))
+        test_generic(cfvcmd + ' -p %s -r -s -T' % d, rcurry(cfv_all_test, files=5, ok=1, notfound=4))
+        test_generic(cfvcmd + ' -p %s -r --search=tree -T' % d, rcurry(cfv_all_test, files=5, ok=5, misnamed=4))
+        test_generic(cfvcmd + ' -p %s -r --search=tree -n -T' % d, rcurry(cfv_all_test, files=5, ok=5, misnamed=2))
+        test_generic(cfvcmd + ' -p %s -r -T' % d, rcurry(cfv_all_test, files=5, ok=5))
+        r = os.path.exists(os.path.join(d, 'c', 'uno')) or os.path.exists(os.path.join(d, 'b', 'two'))
+        test_log_results('search_tree renamed back', r, '', r, None)
+        if hasattr(os, 'symlink'):
+            # dirs linked into the tree are searched unless -L, like with -r.
+            x = tempfile.mkdtemp()
+            try:
+                os.rename(os.path.join(d, 'b', 'three'), os.path.join(x, 'tres'))
+                os.symlink(x, os.path.join(d, 'link'))
+                test_generic(cfvcmd + ' -p %s -r -L --search=tree -T' % d, rcurry(cfv_all_test, files=5, ok=4, notfound=1))
+                test_generic(cfvcmd + ' -p %s -r --search=tree -T' % d, rcurry(cfv_all_test, files=5, ok=5, misnamed=1))
+            finally:
+                shutil.rmtree(x)
+    finally:
+        shutil.rmtree(d)
+    # of several files with the right contents, the one in the same dir as the missing file is used.
+    d = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(d, 'sub'))
+        for fn in ('atroot', 'sub/local'):
+            writefile(os.path.join(d, fn), b'same')
+        writefile(os.path.join(d, 'sub', 'test.md5'), ('%s *orig\n' % hashlib.md5(b'same').hexdigest()).encode('ascii'))
+        test_generic(cfvcmd + ' -p %s -r --search=tree -n -T' % d, rcurry(cfv_all_test, ok=1, misnamed=1))
+        r = not (os.path.exists(os.path.join(d, 'sub', 'orig')) and os.path.exists(os.path.join(d, 'atroot')))
+        test_log_results('search_tree same dir first', r, str(os.listdir(os.path.join(d, 'sub'))), r, None)
+    finally:
+        shutil.rmtree(d)
+
+
+def make_walk_test():
+    """Check the order and the entries of a checksum file made from a tree with -rr."""
+    d = tempfile.mkdtemp()
+    try:
+        for fn in ('b', 'a/z', 'a/b/y', 'a/c', 'A', 'c/d/e/f'):
+            os.makedirs(os.path.join(d, os.path.dirname(fn)), exist_ok=True)
+            writefile(os.path.join(d, fn), fn.encode('ascii'))
+        os.makedirs(os.path.join(d, 'empty'))
+        if hasattr(os, 'symlink'):
+            os.symlink('nowhere', os.path.join(d, 'broken'))
+        test_generic(cfvcmd + ' -p %s -C -rr -t sfv -f test.sfv' % d, rcurry(cfv_all_test, ok=6))
+        names = [line.split(' ')[0].replace(os.sep, '/') for line in readfile(os.path.join(d, 'test.sfv'), textmode=True).splitlines() if not line.startswith(';')]
+        expected = ['A', 'a/b/y', 'a/c', 'a/z', 'b', 'c/d/e/f']
+        test_log_results('make_walk order', names != expected, str(names), names != expected, None)
+    finally:
+        shutil.rmtree(d)
+
+
+def update_test():
+    """Check updating checksum files, without reading the files already in them again unless asked to."""
+    for t in ('sha256', 'sfv', 'csv', 'bsdmd5'):
+        d = tempfile.mkdtemp()
+        try:
+            cf = os.path.join(d, 'test.' + t)
+            for fn in ('a', 'b', 'c', 'sub/d'):
+                os.makedirs(os.path.join(d, os.path.dirname(fn)), exist_ok=True)
+                writefile(os.path.join(d, fn), fn.encode('ascii'))
+            test_generic(cfvcmd + ' -p %s -C -rr -t %s -f %s' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            test_generic(cfvcmd + ' -p %s -C -rr -t %s -f %s' % (d, t, cf), rcurry(cfv_status_test, cferror=1))
+            # change a without changing its size or mtime, so only reading it again would notice.
+            st = os.stat(os.path.join(d, 'a'))
+            writefile(os.path.join(d, 'a'), b'A')
+            os.utime(os.path.join(d, 'a'), ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.unlink(os.path.join(d, 'b'))
+            writefile(os.path.join(d, 'sub', 'e'), b'new')
+            test_generic(cfvcmd + ' -p %s -C -rr -t %s -f %s --update' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            test_generic(cfvcmd + ' -p %s -T -f %s' % (d, cf), rcurry(cfv_all_test, ok=3, badcrc=1))
+            test_generic(cfvcmd + ' -p %s -C -t %s -f %s --update-changed c' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            test_generic(cfvcmd + ' -p %s -T -f %s' % (d, cf), rcurry(cfv_all_test, ok=3, badcrc=1))
+            os.utime(os.path.join(d, 'a'), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 10))
+            test_generic(cfvcmd + ' -p %s -C -t %s -f %s --update-changed c' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            test_generic(cfvcmd + ' -p %s -T -u -f %s' % (d, cf), rcurry(cfv_all_test, ok=4))
+            r = [n for n in os.listdir(d) if n.startswith('.cfv')]
+            test_log_results('update %s no temp files' % t, bool(r), str(r), r, None)
+            # a file changed without changing its size keeps its entry, until --update-changed sees it was modified after the checksum file.
+            writefile(os.path.join(d, 'a'), b'Z')
+            test_generic(cfvcmd + ' -p %s -C -t %s -f %s --update c' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            test_generic(cfvcmd + ' -p %s -T -f %s' % (d, cf), rcurry(cfv_all_test, ok=3, badcrc=1))
+            test_generic(cfvcmd + ' -p %s -C -t %s -f %s --update-changed c' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            test_generic(cfvcmd + ' -p %s -T -f %s' % (d, cf), rcurry(cfv_all_test, ok=4))
+            # after --update-changed, the checksum file is as recent as the run, so the files aren't all read again next time.
+            os.utime(cf, (1577836800, 1577836800))
+            start = time.time()
+            test_generic(cfvcmd + ' -p %s -C -t %s -f %s --update-changed c' % (d, t, cf), rcurry(cfv_all_test, ok=4))
+            r = os.stat(cf).st_mtime < start - 2
+            test_log_results('update-changed %s mtime' % t, r, str(os.stat(cf).st_mtime), r, None)
+            # a checksum file that can't be read entirely is left alone.
+            with open(cf, 'ab') as f:
+                f.write(b'garbage\n')
+            test_generic(cfvcmd + ' -p %s -C -t %s -f %s --update' % (d, t, cf), rcurry(cfv_status_test, cferror=1))
+            r = not readfile(cf).endswith(b'garbage\n')
+            test_log_results('update %s unreadable' % t, r, '', r, None)
+        finally:
+            shutil.rmtree(d)
+    # the names in the checksum file are matched after --unquote, --fixpaths and --strippaths, like when testing.
+    d = tempfile.mkdtemp()
+    try:
+        writefile(os.path.join(d, 'a'), b'a')
+        writefile(os.path.join(d, 'test.sfv'), b'"x/a" 00000000\n')
+        test_generic(cfvcmd + ' -p %s -C -t sfv -f test.sfv --update --unquote=yes --strippaths=1 a' % d, rcurry(cfv_all_test, ok=1))
+        names = [line for line in readfile(os.path.join(d, 'test.sfv'), textmode=True).splitlines() if not line.startswith(';')]
+        test_log_results('update mangled names', names != ['a 00000000'], str(names), None, None)
+    finally:
+        shutil.rmtree(d)
+
+
+def compressed_test():
+    """Check making and testing bzip2, xz and zstd compressed checksum files, found by their extension or their contents, and that corrupt ones are checksum file errors."""
+    compressions = [('.bz2', b'BZh'), ('.xz', b'\xfd7zXZ\x00')]
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        compressions.append(('.zst', b'\x28\xb5\x2f\xfd'))
+    for ext, magic in compressions:
+        d = tempfile.mkdtemp()
+        try:
+            writefile(os.path.join(d, 'data1'), b'data1')
+            test_generic(cfvcmd + ' -p %s -C -f test.sfv%s data1' % (d, ext), cfv_test)
+            cf = os.path.join(d, 'test.sfv' + ext)
+            test_log_results('compressed magic ' + ext, readfile(cf)[:len(magic)] != magic, repr(readfile(cf)[:16]), None, None)
+            test_generic(cfvcmd + ' -p %s -T' % d, rcurry(cfv_all_test, ok=1))
+            shutil.copyfile(cf, os.path.join(d, 'noext'))
+            test_generic(cfvcmd + ' -p %s -T -f noext' % d, rcurry(cfv_all_test, ok=1))
+            test_generic(cfvcmd + ' -p %s -T -f -' % d, rcurry(cfv_all_test, ok=1), stdin=cf)
+            test_generic(cfvcmd + ' -p %s -ZZ -T -f noext' % d, rcurry(cfv_status_test, cferror=1))
+            data = readfile(cf)
+            os.unlink(os.path.join(d, 'noext'))
+            writefile(cf, data[:12] + bytes(c ^ 0xff for c in data[12:24]) + data[24:])
+            test_generic(cfvcmd + ' -p %s -T -f test.sfv%s' % (d, ext), rcurry(cfv_status_test, cferror=1))
+            test_generic(cfvcmd + ' -p %s -m -T' % d, rcurry(cfv_status_test, cferror=1))
+            test_generic(cfvcmd + ' -p %s -T -f -' % d, rcurry(cfv_status_test, cferror=1), stdin=cf)
+        finally:
+            shutil.rmtree(d)
+
+
 def all_unittest_tests():
     if not run_internal:
         return 0
@@ -1682,6 +2046,12 @@ def all_tests():
         T_test('.torrent', extra='--strip=%s' % strip)
         T_test('smallpiece.torrent', extra='--strip=%s' % strip)
         T_test('encoding.torrent', extra='--strip=%s' % strip)
+    T_test('.sfv', extra='--archival=yes')
+    T_test('.md5', extra='--archival=yes')
+    T_test('smallpiece.torrent', extra='--archival=yes')
+    T_test('.sfv', extra='--io=buffered')
+    T_test('.md5', extra='--io=direct')
+    T_test('.md5', extra='--io=direct --archival=yes')
 
     def cfv_torrentcommentencoding_test(s, o):
         r = cfv_all_test(s, o, ok=1)
@@ -1758,6 +2128,23 @@ def all_tests():
     C_test('csv4', '-t csv4')
     C_test('crc')
     private_torrent_test()
+    multitype_C_test()
+    jobs_test()
+    ren_test('sha256', extra='-j 3')
+    search_test('csv', extra='-j 3')
+    jobs_test(extra='-j 2 --pool=process')
+    ren_test('sfv', extra='-j 2 --pool=process')
+    jobs_test(extra='-j 2 --io=direct')
+    hashcache_test()
+    xattr_cache_test()
+    hardlink_test()
+    multimanifest_test()
+    bulkparse_test()
+    compressed_test()
+    search_many_test()
+    search_tree_test()
+    make_walk_test()
+    update_test()
     # test_generic('../cfv -V -T -f test.md5', cfv_test)
     # test_generic('../cfv -V -tcsv -T -f test.md5', cfv_test)
     for t in allavailablefmts():
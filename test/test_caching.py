@@ -22,10 +22,16 @@ import os
 import shutil
 import tempfile
 
-from cfv.caching import FileInfoCache
+from cfv import caching
+from cfv.caching import FileInfoCache, HashStore
 from cfvtest import TestCase
 
 
+def readfile(fn):
+    with open(fn) as f:
+        return f.read()
+
+
 class AbsTestCase(TestCase):
     def setUp(self):
         self.tempdir = tempfile.mkdtemp()
@@ -95,6 +101,10 @@ class AbsPathKeyTest(AbsTestCase):
         else:
             self.assertNotEqual(keya, keyc)
 
+        if st.st_ino:
+            # a stat result that is given is used instead of stat'ing the path, which doesn't exist.
+            self.assertEqual(keyc, cache.get_path_key(self.mkpath('non_existent'), st))
+
     def test_rename(self):
         cache = FileInfoCache()
         a = self.mkfile('a', 'a')
@@ -128,6 +138,94 @@ class AbsPathKeyTest(AbsTestCase):
         self.assertDictEqual({'f2': 1}, cache.getfinfo(a))
         self.assertDictEqual({}, cache.getfinfo(b))
 
+    def test_hardlinks(self):
+        cache = FileInfoCache()
+        a = self.mkfile('a', 'a')
+        b = self.mkpath('b')
+        c = self.mkfile('c', 'c')
+        try:
+            os.link(a, b)
+        except (AttributeError, OSError):
+            return
+        cache.getcinfo(a)['md5'] = 1
+        cache.set_flag(a, '_ok')
+        self.assertIs(cache.getcinfo(a), cache.getcinfo(b))
+        self.assertIs(cache.getcinfo(a), cache.getcinfo(a, os.stat(b)))
+        self.assertDictEqual({}, cache.getcinfo(c))
+        self.assertTrue(cache.has_flag(a, '_ok'))
+        self.assertFalse(cache.has_flag(b, '_ok'))
+
+        os.rename(a, self.mkpath('d'))
+        cache.rename(a, self.mkpath('d'))
+        self.assertDictEqual({'md5': 1}, cache.getcinfo(self.mkpath('d')))
+        self.assertFalse(cache.has_flag(self.mkpath('d'), '_ok'))
+
+    def test_size_index(self):
+        cache = FileInfoCache()
+        self.mkfile('a', 'aa')
+        self.mkfile('b', 'bb')
+        self.mkfile('c', 'ccc')
+        self.mkfile('sub/d', 'dd')
+        index = cache.size_index(self.tempdir)
+        self.assertEqual(['a', 'b'], sorted(index[2]))
+        self.assertEqual(['c'], index[3])
+        self.assertEqual(['a', 'b', 'c'], sorted(index[-1]))
+        self.assertIs(index, cache.size_index(self.tempdir))
+
+        os.rename(self.mkpath('a'), self.mkpath('e'))
+        cache.rename(self.mkpath('a'), self.mkpath('e'))
+        os.rename(self.mkpath('b'), self.mkpath('sub/b'))
+        cache.rename(self.mkpath('b'), self.mkpath('sub/b'))
+        self.assertEqual(['e'], index[2])
+        self.assertEqual(['c', 'e'], sorted(index[-1]))
+        # the index of a dir that wasn't listed yet is made from scratch.
+        self.assertEqual(['b', 'd'], sorted(cache.size_index(self.mkpath('sub'))[2]))
+
+    def test_tree_size_index(self):
+        cache = FileInfoCache()
+        self.mkfile('a', 'aa')
+        self.mkfile('sub/b', 'bb')
+        self.mkfile('sub/subsub/c', 'ccc')
+        index = cache.tree_size_index(self.tempdir)
+        self.assertEqual([self.mkpath('a'), self.mkpath('sub/b')], index[2])
+        self.assertEqual([self.mkpath('sub/subsub/c')], index[3])
+        digests = cache.digest_index(self.tempdir, 2, 'len', readfile, tree=True)
+        self.assertEqual([self.mkpath('sub/b')], digests['bb'])
+
+        os.rename(self.mkpath('sub/b'), self.mkpath('sub/subsub/b'))
+        cache.rename(self.mkpath('sub/b'), self.mkpath('sub/subsub/b'))
+        self.assertEqual([self.mkpath('a'), self.mkpath('sub/subsub/b')], index[2])
+        self.assertEqual([], digests['bb'])
+        digests = cache.digest_index(self.tempdir, 2, 'len', readfile, tree=True)
+        self.assertEqual([self.mkpath('sub/subsub/b')], digests['bb'])
+
+    def test_tree_size_index_followlinks(self):
+        self.mkfile('a', 'aa')
+        self.mkfile('sub/b', 'bb')
+        os.symlink(self.mkpath('sub'), self.mkpath('link'))
+        # a link back up the tree must not be walked again.
+        os.symlink(self.tempdir, self.mkpath('sub/loop'))
+        self.assertEqual([self.mkpath('a'), self.mkpath('sub/b')], FileInfoCache().tree_size_index(self.tempdir)[2])
+        self.assertEqual([self.mkpath('a'), self.mkpath('link/b')], FileInfoCache().tree_size_index(self.tempdir, followlinks=True)[2])
+
+    def test_digest_index_prefilter(self):
+        cache = FileInfoCache()
+        self.mkfile('a', 'aa')
+        self.mkfile('b', 'bb')
+        read = []
+
+        def getdigest(fn):
+            read.append(os.path.basename(fn))
+            return readfile(fn)
+        index = cache.digest_index(self.tempdir, 2, 'len', getdigest, prefilter=lambda fn: readfile(fn)[0] == 'b')
+        self.assertEqual(['b'], index['bb'])
+        self.assertEqual(['b'], read)
+        # files passed over by the prefilter are still there for later searches.
+        self.assertEqual(['a'], index[None])
+        index = cache.digest_index(self.tempdir, 2, 'len', getdigest)
+        self.assertEqual(['a'], index['aa'])
+        self.assertEqual(['b', 'a'], read)
+
 
 class RelPathKeyTest(RelTestCase):
     def test_nocase_findfile(self):
@@ -160,3 +258,61 @@ class RelPathKeyTest(RelTestCase):
         with self.assertRaises(IOError) as cm:
             cache.nocase_findfile(self.mkpath('aaAA/aaa2'))
         self.assertEqual(errno.EEXIST, cm.exception.errno)
+
+
+class HashStoreTest(AbsTestCase):
+    def test_get_put(self):
+        fn = self.mkpath('sub/hashes.sqlite')
+        store = HashStore(fn, 10)
+        self.assertEqual({}, store.get((1, 2, 3, 4)))
+        store.put((1, 2, 3, 4), {'md5': b'a', 'crc': b'b'})
+        store.put((1, 2, 3, 4), {'md5': b'c'})
+        self.assertEqual({'md5': b'c', 'crc': b'b'}, store.get((1, 2, 3, 4)))
+        self.assertEqual({}, store.get((1, 2, 3, 5)))
+        self.assertEqual({}, store.get((1, 3, 3, 4)))
+        store.close()
+
+        store = HashStore(fn, 10)
+        self.assertEqual({'md5': b'c', 'crc': b'b'}, store.get((1, 2, 3, 4)))
+        # a changed file forgets the digests of its old contents.
+        store.put((1, 2, 3, 5), {'sha1': b'd'})
+        self.assertEqual({'sha1': b'd'}, store.get((1, 2, 3, 5)))
+        self.assertEqual({}, store.get((1, 2, 3, 4)))
+        store.close()
+
+    def test_lru(self):
+        fn = self.mkpath('hashes.sqlite')
+        store = HashStore(fn, 3)
+        for ino in range(4):
+            store.put((1, ino, 0, 0), {'md5': b'%i' % ino})
+        store.get((1, 0, 0, 0))
+        store.put((1, 4, 0, 0), {'md5': b'4'})
+        store.close()
+        store = HashStore(fn, 3)
+        self.assertEqual([{'md5': b'0'}, {}, {}, {'md5': b'3'}, {'md5': b'4'}], [store.get((1, ino, 0, 0)) for ino in range(5)])
+        store.close()
+
+
+class XattrDigestsTest(AbsTestCase):
+    def test_xattrdigests(self):
+        fn = self.mkfile('foo', 'foo')
+        try:
+            os.setxattr(fn, 'user.cfv.test', b'')
+            os.removexattr(fn, 'user.cfv.test')
+        except (AttributeError, EnvironmentError):
+            return
+        st = os.stat(fn)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        self.assertEqual({}, caching.getxattrdigests(fn, key))
+        caching.putxattrdigests(fn, key, {'md5': b'a', 'crc': b'b'})
+        caching.putxattrdigests(fn, key, {'sha1': b'c'})
+        self.assertEqual({'md5': b'a', 'crc': b'b', 'sha1': b'c'}, caching.getxattrdigests(fn, key))
+        stale = key[:3] + (key[3] + 1,)
+        self.assertEqual({}, caching.getxattrdigests(fn, stale))
+        # digests are only stored for the current state of the file.
+        caching.putxattrdigests(fn, stale, {'sha1': b'd'})
+        self.assertEqual({'md5': b'a', 'crc': b'b', 'sha1': b'c'}, caching.getxattrdigests(fn, key))
+        os.utime(fn, ns=(stale[3], stale[3]))
+        caching.putxattrdigests(fn, stale, {'sha1': b'd'})
+        self.assertEqual({'sha1': b'd'}, caching.getxattrdigests(fn, stale))
+        self.assertEqual({}, caching.getxattrdigests(fn, key))
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+#    test_cftypes.py - tests of cfv checksum file type registry
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from io import BytesIO
+
+import cfvtest
+from cfv import cftypes
+from cfv.fileutil import PeekFile
+from cfvtest import TestCase
+
+
+class FakeType(object):
+    name = 'faketype'
+    auto_chksumfile_order = 10
+
+    @staticmethod
+    def auto_chksumfile_match(file):
+        return file.peek(4) == b'FAKE'
+
+
+class LazyRegistryTest(TestCase):
+    def setUp(self):
+        self.saved = [(container, container.copy()) for container in (cftypes._cftypes, cftypes._cftype_loaders, cftypes._cf_fn_exts, cftypes._cftypes_match_order)]
+        self.loads = 0
+
+    def tearDown(self):
+        for container, saved in self.saved:
+            container.clear()
+            if isinstance(saved, dict):
+                container.update(saved)
+            else:
+                container.extend(saved)
+
+    def loader(self):
+        self.loads += 1
+        return FakeType
+
+    def test_load_on_use(self):
+        cftypes.register_lazy_cftype('faketype', self.loader, auto_filename_match='fake$', auto_chksumfile_order=10)
+        self.assertTrue(cftypes.has_handler('faketype'))
+        self.assertIn('faketype', cftypes.get_handler_names())
+        self.assertEqual(0, self.loads)
+        self.assertIs(FakeType, cftypes.auto_filename_match('foo.fake'))
+        self.assertIs(FakeType, cftypes.get_handler('faketype'))
+        self.assertEqual(1, self.loads)
+
+    def test_sniff_without_loading(self):
+        cftypes.register_lazy_cftype('faketype', self.loader, auto_chksumfile_order=10, auto_chksumfile_match=FakeType.auto_chksumfile_match)
+        cftypes.auto_chksumfile_match(PeekFile(BytesIO(b'nope'), 'test'))
+        self.assertEqual(0, self.loads)
+        self.assertIs(FakeType, cftypes.auto_chksumfile_match(PeekFile(BytesIO(b'FAKE'), 'test')))
+        self.assertEqual(1, self.loads)
+
+    def test_sniff_loads(self):
+        cftypes.register_lazy_cftype('faketype', self.loader, auto_chksumfile_order=10)
+        self.assertIs(FakeType, cftypes.auto_chksumfile_match(PeekFile(BytesIO(b'FAKE'), 'test')))
+        self.assertEqual(1, self.loads)
+
+
+if __name__ == '__main__':
+    cfvtest.main()
@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+
+#    test_fileutil.py - tests of cfv fileutil module
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from io import BufferedReader, BytesIO, RawIOBase, UnsupportedOperation
+
+import cfvtest
+from cfv.fileutil import PeekFile, PeekFileNonseekable, PeekHead, PeekStream, compressed_ext, plainlines
+from cfvtest import TestCase
+
+
+# lines are compared without their line ends, since in plain blocks the \r\r\n of corrupted files stays part of the line instead of being dropped as an empty line.
+def readlines(data, encoding='auto'):
+    f = PeekFile(BytesIO(data), 'test', encoding)
+    lines = []
+    while 1:
+        try:
+            line = f.readline()
+        except UnicodeError:
+            lines.append(UnicodeError)
+            continue
+        if not line:
+            return lines
+        lines.append(line.rstrip('\r\n'))
+
+
+def readblocks(data, size, encoding='auto'):
+    f = PeekFile(BytesIO(data), 'test', encoding)
+    lines = []
+    while 1:
+        block = f.readblock(size)
+        if not block:
+            return lines
+        if f.isplainblock(block):
+            lines.extend(line.rstrip('\r\n') for line in plainlines(block))
+        else:
+            lines.extend(isinstance(line, UnicodeError) and UnicodeError or line.rstrip('\r\n') for line in f.blocklines(block))
+
+
+class ReadBlockTest(TestCase):
+    def check(self, data, encoding='auto'):
+        expected = readlines(data, encoding)
+        for size in (1, 3, 7, 100, 2 ** 20):
+            self.assertEqual(expected, readblocks(data, size, encoding))
+
+    def test_lineends(self):
+        self.check(b'a\nbb\r\nccc\r\r\ndd\rd\n\ne')
+        self.check(b'a\r\r\n\r\nb\r\r\r\n')
+        self.check(b'a\x0cb\nc\x1dd\n')
+        self.check(b'no newline at end\r')
+
+    def test_badbytes(self):
+        self.check(b'abc\n\xff\xfe\xfd\ndef\n', 'utf-8')
+
+    def test_bom(self):
+        self.check('\ufeffa\nb\r\nc'.encode('utf-16-le'))
+        self.check('\ufeffa\nb\r\nc'.encode('utf-8'))
+
+    def test_peek_then_readblock(self):
+        f = PeekFile(BytesIO(b'first\nsecond\nthird'), 'test')
+        self.assertEqual('first\n', f.peekline())
+        self.assertEqual('first\nsecond\n', f.readblock())
+        self.assertEqual('third', f.readblock())
+        self.assertEqual('', f.readblock())
+
+    def test_plainlines(self):
+        self.assertEqual(['a\r\r\n', '\n', 'b'], plainlines('a\r\r\n\nb'))
+        self.assertEqual(['a\n'], plainlines('a\n'))
+        self.assertEqual([], plainlines(''))
+
+    def test_plainblock(self):
+        f = PeekFile(BytesIO(b''), 'test', 'utf-8')
+        self.assertTrue(f.isplainblock('a\nb\r\nc\r\r\n'))
+        self.assertFalse(f.isplainblock('a\rb\n'))
+        self.assertFalse(f.isplainblock('a\r\r\r\n'))
+        self.assertFalse(f.isplainblock('a\ufffeb\n'))
+        self.assertFalse(f.isplainblock('a\u2028b\n'))
+        f = PeekFile(BytesIO(b''), 'test', 'cp500')
+        self.assertFalse(f.isplainblock('a\u2028b\n'))
+
+    def test_textio(self):
+        data = b'a\nbb\r\nccc\r\r\ndd\rd\x0ce\n\xff\n'
+        self.assertEqual(['a', 'bb', 'ccc', 'dd', 'd\x0c', 'e', UnicodeError], readlines(data, 'utf-8'))
+        self.assertEqual(['a', 'bb', 'ccc', 'dd', 'd\x0c', 'e', '\xff'], readlines(data, 'latin-1'))
+        self.check(data, 'utf-8')
+        self.check(data, 'latin-1')
+        self.check('\ufeffa\r\r\nb\rc\n'.encode('utf-32'))
+
+    def test_codecs(self):
+        data = 'a\nb\r\r\nc\x0cd\n'.encode('cp500')
+        self.assertEqual(['a', 'b', 'c\x0c', 'd'], readlines(data, 'cp500'))
+        self.check(data, 'cp500')
+
+    def test_same_lines_for_all_codecs(self):
+        # the io reader used for some encodings splits lines at the same breaks as the codecs StreamReader used for others.
+        text = 'a\x0cb\n\x85c\x1dd\re\r\r\nf\x1cg\x0bh\r\n'
+        expected = ['a\x0c', 'b', '\x85', 'c\x1d', 'd', 'e', 'f\x1c', 'g\x0b', 'h']
+        for encoding in ('utf-8', 'latin-1', 'utf-16-le', 'cp500', 'cp037'):
+            self.assertEqual(expected, readlines(text.encode(encoding), encoding))
+            self.check(text.encode(encoding), encoding)
+        self.assertEqual(['a\u2028', 'b\u2029', 'c'], readlines('a\u2028b\u2029c'.encode('utf-8'), 'utf-8'))
+
+    def test_raw_keeps_file_open(self):
+        fileobj = BytesIO(b'abc\n')
+        f = PeekFile(fileobj, 'test', 'utf-8')
+        self.assertEqual('abc\n', f.peekline())
+        self.assertEqual(b'abc\n', f.read())
+        self.assertFalse(fileobj.closed)
+
+
+def peeklines(f, count, size=4096):
+    lines = [f.peekline(size)]
+    for i in range(count):
+        lines.append(f.peeknextline(size))
+    return lines
+
+
+class PeekHeadTest(TestCase):
+    def check(self, data, encoding='auto', count=8):
+        f = PeekFile(BytesIO(data), 'test', encoding)
+        expected = peeklines(f, count), f.peekdecoded(10), f.peek(5), f._decode_errs
+        for size in (4, 9, 2 ** 16):
+            f = PeekFile(BytesIO(data), 'test', encoding)
+            head = PeekHead(f, size)
+            self.assertEqual(expected, (peeklines(head, count), head.peekdecoded(10), head.peek(5), f._decode_errs))
+            # peekline starts over, also after falling back to the file.
+            self.assertEqual(expected[0], peeklines(head, count))
+
+    def test_lines(self):
+        self.check(b'; comment\n;another\r\nabc 12345678\r\r\ndef 12345678\rlast')
+        self.check(b'a\x0cb\nc\u2028d\n', 'cp500')
+        self.check(b'a\x0cb\nc\x1cd\r\x85e\n', 'latin-1')
+        self.check('\ufeffa\r\nb\nc'.encode('utf-16-le'))
+
+    def test_line_limit(self):
+        self.check(b'x' * 10 + b'\r\n' + b'y' * 5, count=3)
+        self.check(b'x' * 4094 + b'\x0cyy\x1czz\n', 'latin-1', count=4)
+        f = PeekFile(BytesIO(b'x' * 5000 + b'\n'), 'test', 'utf-8')
+        self.assertEqual(['x' * 4096, 'x' * 904 + '\n', ''], peeklines(PeekHead(f), 2))
+
+    def test_badbytes(self):
+        self.check(b'abc\n\xff\ndef\n', 'utf-8')
+        f = PeekFile(BytesIO(b'abc\n\xff\ndef\n'), 'test', 'utf-8')
+        self.assertEqual(['abc\n', '', 'def\n'], peeklines(PeekHead(f), 2))
+        self.assertEqual(1, f._decode_errs)
+
+    def test_peek(self):
+        f = PeekFile(BytesIO(b'PAR2\0PKT' + b'x' * 100), 'test')
+        head = PeekHead(f, 16)
+        self.assertEqual(b'PAR2\0PKT', head.peek(8))
+        self.assertEqual(b'PAR2\0PKT' + b'x' * 100, head.peek())
+        self.assertEqual(b'PAR2\0PKT' + b'x' * 92, head.peek(100))
+
+
+class Pipe(RawIOBase):
+    """A nonseekable stream, that returns short reads."""
+
+    def __init__(self, data):
+        self.data = BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.data.read(min(len(b), 5))
+        b[:len(data)] = data
+        return len(data)
+
+
+class PeekStreamTest(TestCase):
+    def test_peek_then_stream(self):
+        data = b''.join(b'%08x  file%d\n' % (i, i) for i in range(2000))
+        stream = PeekStream(BufferedReader(Pipe(data)))
+        f = PeekFile(stream, '-')
+        self.assertEqual('00000000  file0\n', f.peekline())
+        self.assertEqual(b'0000', f.peek(4))
+        lines = []
+        while 1:
+            block = f.readblock(1000)
+            if not block:
+                break
+            lines.extend(plainlines(block))
+            # only the head read while peeking is kept, and it is dropped once read past.
+            self.assertLessEqual(len(stream._head), 8192)
+        self.assertEqual(data.decode('ascii'), ''.join(lines))
+        self.assertEqual(b'', stream._head)
+
+    def test_seek(self):
+        stream = PeekStream(Pipe(b'0123456789' * 10))
+        self.assertEqual(b'0123', stream.read(4))
+        stream.seek(0)
+        self.assertEqual(b'01234567890', stream.read(11))
+        stream.seek(2, 1)
+        self.assertEqual(b'34', stream.read(2))
+        stream.done_peeking()
+        stream.seek(30)
+        self.assertEqual(b'01', stream.read(2))
+        self.assertRaises(UnsupportedOperation, stream.seek, 0)
+        self.assertEqual(68, len(stream.read()))
+        self.assertEqual(b'', stream.read(1))
+
+    def test_binary(self):
+        data = b'PAR2\0PKT' + bytes(range(256)) * 100
+        f = PeekFileNonseekable(Pipe(data), '-', 'auto')
+        self.assertEqual(b'PAR2\0PKT', PeekHead(f).peek(8))
+        self.assertEqual(data, f.read())
+
+
+class CompressedExtTest(TestCase):
+    def test_compressed_ext(self):
+        self.assertEqual('.gz', compressed_ext('foo.md5.gz'))
+        self.assertEqual('.xz', compressed_ext('foo.SHA256.XZ'))
+        self.assertEqual('.bz2', compressed_ext('foo.sfv.bz2'))
+        self.assertEqual('.zst', compressed_ext('foo.zst'))
+        self.assertEqual('', compressed_ext('foo.sfv'))
+        self.assertEqual('', compressed_ext('xz'))
+
+
+if __name__ == '__main__':
+    cfvtest.main()
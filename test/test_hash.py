@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+
+#    test_hash.py - tests of cfv hash module
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import zlib
+
+import cfvtest
+from cfv import hash
+from cfvtest import TestCase
+
+
+class HashTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def mkfile(self, name, size):
+        data = bytes(bytearray(random.getrandbits(8) for _ in range(size)))
+        fn = os.path.join(self.tempdir, name)
+        with open(fn, 'wb') as f:
+            f.write(data)
+        return fn, data
+
+
+class MultiDigestTest(HashTestCase):
+    def test_getfilechecksums(self):
+        for size in (0, 1, 65535, 65536, 200001):
+            fn, data = self.mkfile('f%i' % size, size)
+            for callback in (None, lambda s: None):
+                hashers = {'crc': hash.CRC32, 'md5': hash.md5, 'sha256': hash.gethasher('sha256')}
+                digests, s = hash.getfilechecksums(fn, hashers, callback)
+                self.assertEqual(size, s)
+                self.assertEqual(hash.CRC32(data).digest(), digests['crc'])
+                self.assertEqual(hashlib.md5(data).digest(), digests['md5'])
+                self.assertEqual(hashlib.sha256(data).digest(), digests['sha256'])
+                self.assertEqual((digests['crc'], size), hash.getfilecrc(fn, callback))
+
+    def test_mmap_windows(self):
+        if hash._nommap:
+            return
+        orig_window = hash._MMAP_WINDOW
+        orig_slice = hash._MMAP_SLICE
+        hash._MMAP_WINDOW = hash.mmap.ALLOCATIONGRANULARITY
+        hash._MMAP_SLICE = 1000
+        try:
+            for size in (hash._MMAP_WINDOW - 1, hash._MMAP_WINDOW, hash._MMAP_WINDOW * 3 + 1):
+                fn, data = self.mkfile('f%i' % size, size)
+                digests, s = hash.getfilechecksums(fn, {'md5': hash.md5}, None)
+                self.assertEqual((hashlib.md5(data).digest(), size), (digests['md5'], s))
+                progress = []
+                digests, s = hash.getfilechecksums(fn, {'md5': hash.md5}, progress.append)
+                self.assertEqual((hashlib.md5(data).digest(), size), (digests['md5'], s))
+                self.assertEqual(sorted(progress), progress)
+                self.assertEqual(size, progress[-1])
+        finally:
+            hash._MMAP_WINDOW = orig_window
+            hash._MMAP_SLICE = orig_slice
+
+    def test_reader(self):
+        fn, data = self.mkfile('foo', 100000)
+        for blocksize in (512, 4096, hash.DEFAULT_BLOCKSIZE):
+            reader = hash.Reader(blocksize)
+            with open(fn, 'rb') as f:
+                m = hashlib.md5()
+                self.assertEqual(100000, reader.feed(f, [m], None))
+                self.assertEqual(hashlib.md5(data).digest(), m.digest())
+                f.seek(10)
+                m = hashlib.md5()
+                progress = []
+                self.assertEqual(1000, reader.feed(f, [m], progress.append, size=1000))
+                self.assertEqual(hashlib.md5(data[10:1010]).digest(), m.digest())
+                self.assertEqual(1000, progress[-1])
+            digests, s = hash.getfilechecksums(fn, {'crc': hash.CRC32}, None, reader=reader)
+            self.assertEqual((struct_crc(data), 100000), (digests['crc'], s))
+
+    def test_archival(self):
+        fn, data = self.mkfile('foo', 100000)
+        reader = hash.Reader(4096, archival=True)
+        orig_interval = hash._DROP_INTERVAL
+        hash._DROP_INTERVAL = 30000
+        dropped = []
+        reader.drop = lambda f, offset, length: dropped.append((offset, length))
+        try:
+            with reader.open(fn) as f:
+                m = hashlib.md5()
+                self.assertEqual(100000, reader.feed(f, [m], None))
+        finally:
+            hash._DROP_INTERVAL = orig_interval
+        self.assertEqual(hashlib.md5(data).digest(), m.digest())
+        self.assertEqual(100000, sum(length for offset, length in dropped))
+        self.assertEqual(0, dropped[0][0])
+        self.assertEqual(len(dropped), len(set(dropped)))
+        digests, s = hash.getfilechecksums(fn, {'md5': hash.md5, 'crc': hash.CRC32}, None, reader=hash.Reader(archival=True))
+        self.assertEqual((hashlib.md5(data).digest(), struct_crc(data), 100000), (digests['md5'], digests['crc'], s))
+
+    def test_archival_drop_from_read_position(self):
+        fn, data = self.mkfile('foo', 10000)
+        for archival, expected in ((True, [(5000, 5000)]), (False, [])):
+            reader = hash.Reader(4096, archival=archival)
+            dropped = []
+            reader.drop = lambda f, offset, length: dropped.append((offset, length))
+            with open(fn, 'rb') as f:
+                f.seek(5000)
+                m = hashlib.md5()
+                self.assertEqual(5000, reader.feed(f, [m], None))
+            self.assertEqual(hashlib.md5(data[5000:]).digest(), m.digest())
+            self.assertEqual(expected, dropped)
+
+    def test_feedfile_size(self):
+        fn, data = self.mkfile('foo', hash.DIRECT_BLOCKSIZE + 100)
+        for io in hash.IO_MODES:
+            for archival in (False, True):
+                for size in (0, 100, 16384, hash.DIRECT_BLOCKSIZE + 1000):
+                    m = hashlib.md5()
+                    self.assertEqual(min(size, len(data)), hash.Reader(io=io, archival=archival).feedfile(fn, [m], None, size))
+                    self.assertEqual(hashlib.md5(data[:size]).digest(), m.digest())
+
+    def test_io_modes(self):
+        for size in (0, 1, 4095, 4096, 4097, hash.DIRECT_BLOCKSIZE + 1):
+            fn, data = self.mkfile('f%i' % size, size)
+            for io in hash.IO_MODES:
+                progress = []
+                digests, s = hash.getfilechecksums(fn, {'md5': hash.md5}, progress.append, reader=hash.Reader(io=io))
+                self.assertEqual((hashlib.md5(data).digest(), size), (digests['md5'], s))
+                self.assertEqual([size] if size else [], progress[-1:])
+
+    def test_direct_unaligned(self):
+        fn, data = self.mkfile('foo', 100000)
+        reader = hash.Reader(io='direct')
+        f = reader.opendirect(fn)
+        if f is None:
+            return
+        with f:
+            f.seek(10)
+            m = hashlib.md5()
+            self.assertEqual(5000, reader.feed(f, [m], None, size=5000))
+            self.assertEqual(hashlib.md5(data[10:5010]).digest(), m.digest())
+        self.assertIsNone(hash.Reader().opendirect(fn))
+
+    def test_gethasher(self):
+        self.assertIs(hash.CRC32, hash.gethasher('crc'))
+        self.assertEqual(hashlib.sha1(b'foo').digest(), hash.gethasher('sha1')(b'foo').digest())
+        self.assertEqual(struct_crc(b'foo'), hash.gethasher('crc')(b'foo').digest())
+
+
+class PieceHasherTest(HashTestCase):
+    def test_pieces(self):
+        fn1, data1 = self.mkfile('a', 1000)
+        fn2, data2 = self.mkfile('b', 3000)
+        ph = hash.PieceHasher(1024)
+        hash.getfilechecksums(fn1, {}, None, [ph])
+        hash.getfilechecksums(fn2, {}, None, [ph])
+        data = data1 + data2
+        expected = [hashlib.sha1(data[i:i + 1024]).digest() for i in range(0, len(data), 1024)]
+        self.assertEqual(expected, ph.finish())
+
+
+class CRC32CombineTest(TestCase):
+    def test_crc32_combine(self):
+        for len1, len2 in ((0, 0), (0, 5), (5, 0), (1, 1), (100, 3), (3, 70000)):
+            a = os.urandom(len1)
+            b = os.urandom(len2)
+            self.assertEqual(zlib.crc32(a + b), hash.crc32_combine(zlib.crc32(a), zlib.crc32(b), len2))
+
+    def test_shift_reuse(self):
+        parts = [os.urandom(1000) for _ in range(5)]
+        shift = hash.CRC32Shift(1000)
+        crc = zlib.crc32(parts[0])
+        for part in parts[1:]:
+            crc = shift(crc) ^ zlib.crc32(part)
+        self.assertEqual(zlib.crc32(b''.join(parts)), crc)
+
+
+def struct_crc(data):
+    return (zlib.crc32(data) & 0xFFFFFFFF).to_bytes(4, 'big')
+
+
+if __name__ == '__main__':
+    cfvtest.main()
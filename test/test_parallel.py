@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+
+#    test_parallel.py - tests of cfv parallel module
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import cfvtest
+from cfv import hash
+from cfv import parallel
+from cfvtest import TestCase
+
+
+def square(x):
+    return x * x
+
+
+class PipelineTest(TestCase):
+    def check_order(self, backend, batchsize, window):
+        results = []
+        pipeline = parallel.Pipeline(parallel.get_executor(2, backend), square, window, batchsize)
+        for i in range(50):
+            if i % 7 == 0:
+                pipeline.add(lambda r, i=i: results.append(('deferred', i, r)))
+            else:
+                pipeline.add(lambda r, i=i: results.append(('square', i, r)), i)
+        pipeline.flush()
+        expected = [i % 7 == 0 and ('deferred', i, None) or ('square', i, i * i) for i in range(50)]
+        self.assertEqual(expected, results)
+
+    def test_order_thread(self):
+        for batchsize, window in ((1, 1), (1, 8), (4, 3), (4, 100)):
+            self.check_order('thread', batchsize, window)
+
+    def test_order_process(self):
+        self.check_order('process', 8, 32)
+
+
+class TempDirTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+
+class HashFileTest(TempDirTestCase):
+    def test_hashfile(self):
+        fn = os.path.join(self.tempdir, 'foo')
+        with open(fn, 'wb') as f:
+            f.write(b'foobar')
+        digests, size, key = parallel.hashfile(fn, ['md5', 'crc'])
+        self.assertEqual(hashlib.md5(b'foobar').digest(), digests['md5'])
+        self.assertEqual(6, size)
+        self.assertEqual(parallel.statkey(os.stat(fn)), key)
+        self.assertIsNone(parallel.hashfile(fn, ['md5'], 5))
+        self.assertIsNone(parallel.hashfile(os.path.join(self.tempdir, 'missing'), ['md5']))
+
+
+class CRCRangesTest(TempDirTestCase):
+    def test_getfilecrc(self):
+        for size in (0, 1, 4095, 4096, 4097, 100000):
+            fn = os.path.join(self.tempdir, 'f%i' % size)
+            with open(fn, 'wb') as f:
+                f.write(os.urandom(size))
+            for rangesize in (1, 4096, 5000, 1000000):
+                progress = []
+                self.assertEqual(hash.getfilecrc(fn, None), parallel.getfilecrc(fn, 3, progress.append, rangesize=rangesize))
+
+    def test_hashfile_ranges(self):
+        fn = os.path.join(self.tempdir, 'foo')
+        with open(fn, 'wb') as f:
+            f.write(os.urandom(1000))
+        orig_min = parallel.CRC_RANGES_MIN
+        parallel.CRC_RANGES_MIN = 1
+        try:
+            self.assertEqual(parallel.hashfile(fn, ['crc']), parallel.hashfile(fn, ['crc'], jobs=2))
+        finally:
+            parallel.CRC_RANGES_MIN = orig_min
+
+
+if __name__ == '__main__':
+    cfvtest.main()